@@ -1,20 +1,33 @@
 # The idea of this script is to test how much money we would have made or lost
 # by using the 2017-2018 season and betting to make £2 whenever we find value
 
+import argparse
 from collections import namedtuple
+import glob
+import hashlib
+import itertools
+import json
+from multiprocessing import Pool
 import os
 
 import numpy as np
 import matplotlib.pyplot as plt
+import pandas as pd
 
 import fifa_ratings_predictor.constants as constants
 from fifa_ratings_predictor.data_methods import read_match_data, read_player_data, normalise_features, \
-    assign_odds_to_match, read_all_football_data
-from fifa_ratings_predictor.matching import match_lineups_to_fifa_players, create_feature_vector_from_players
-from fifa_ratings_predictor.model import NeuralNet
+    assign_odds_to_match, read_all_football_data, match_data_path, football_data_directory, PLAYER_DATA_PATH
+from fifa_ratings_predictor.matching import PlayerIndex, PlayerMatchCache, match_lineups_to_fifa_players, \
+    create_feature_vector_from_players
+from fifa_ratings_predictor.features import FEATURE_STORE_DIRECTORY, FeatureStore, TrainingDataset
+from fifa_ratings_predictor.inference import load_predictor
+from fifa_ratings_predictor.monte_carlo import AWAY_WIN, HOME_WIN, results_from_scorelines
 
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 
+BACKTEST_PREDICTIONS_DIRECTORY = './data/backtest-predictions'
+WALK_FORWARD_MODEL_DIRECTORY = './models'
+
 Bet = namedtuple('Bet', ['true_odds', 'predicted_odds', 'stake', 'type', 'profit', 'match'])
 
 
@@ -46,36 +59,161 @@ class BetTracker:
     def roi(self):
         return self.profit / self.invested
 
+    def bootstrap(self, number_of_samples=10000, confidence=0.95, seed=None, compounding=True):
+        """Bootstrap confidence intervals of ROI and maximum drawdown from the completed bets."""
+        stakes = np.array([bet.stake for bet, _ in self.completed_bets])
+        profits = np.array([bet.profit if result == 'W' else -bet.stake for bet, result in self.completed_bets])
+        initial_bankroll = self.bankroll - profits.sum()
+        bankrolls = initial_bankroll + np.concatenate([[0], np.cumsum(profits)[:-1]]) if compounding else None
+        return bootstrap(stakes, profits, number_of_samples=number_of_samples, confidence=confidence, seed=seed,
+                         initial_bankroll=initial_bankroll, bankrolls=bankrolls)
+
 
 def calculate_profit(bet):
     return bet.stake * bet.odds - bet.stake
 
 
-def calculate_stake(odds, method='constant profit', constant_profit=2, probability=None):
+def calculate_stake(odds, method='constant_profit', constant_profit=2, probability=None, kelly_fraction=1.0):
+    """Stake for a bet at the given odds, elementwise if odds and probability are arrays."""
     assert method in ['constant_profit', 'kelly']
     if method == 'constant_profit':
         stake = constant_profit / (odds - 1)
     elif method == 'kelly':
-        stake = ((odds * probability) - 1) / (odds - 1)
+        stake = kelly_fraction * ((odds * probability) - 1) / (odds - 1)
     return stake
 
 
-def main():
-    bet_tracker = BetTracker()
+BacktestResult = namedtuple('BacktestResult', ['bets', 'invested', 'profit', 'roi', 'bankroll', 'stakes', 'profits'])
 
-    league = 'F1'
+BootstrapResult = namedtuple('BootstrapResult', ['roi', 'max_drawdown', 'roi_interval', 'max_drawdown_interval'])
 
-    match_data = read_match_data(season='2017-2018', league=league)
 
-    match_data = assign_odds_to_match(match_data, read_all_football_data(league=league))
+def select_value_bets(probabilities, odds, max_odds=constants.VALUE_BET_MAX_ODDS,
+                      min_edge=constants.VALUE_BET_MIN_EDGE):
+    """Combinations x matches matrix of the outcome backed on each match, or -1 for no bet."""
+    max_odds, min_edge = np.broadcast_arrays(np.atleast_1d(max_odds), np.atleast_1d(min_edge))
+    max_odds, min_edge = max_odds[:, None], min_edge[:, None]
 
-    player_data = read_player_data(season='2017-2018')
+    edges = probabilities - 1 / odds
 
-    net = NeuralNet()
+    def is_value_bet(outcome):
+        return ((1 / probabilities[:, outcome] < odds[:, outcome]) & (odds[:, outcome] < max_odds) &
+                (min_edge <= edges[:, outcome]))
 
-    bank = [100]
+    return np.where(is_value_bet(HOME_WIN), HOME_WIN, np.where(is_value_bet(AWAY_WIN), AWAY_WIN, -1))
 
-    all_odds = []
+
+def backtest(probabilities, odds, outcomes, max_odds=constants.VALUE_BET_MAX_ODDS,
+             min_edge=constants.VALUE_BET_MIN_EDGE, method='kelly', kelly_fraction=1.0, constant_profit=2,
+             initial_bankroll=100):
+    """Back value bets over a season of matches for many strategy parameters at once.
+
+    Returns a BacktestResult with one entry per combination.
+    """
+    assert method in ['constant_profit', 'kelly']
+
+    probabilities = np.asarray(probabilities, dtype=np.float64).reshape(-1, 3)
+    odds = np.asarray(odds, dtype=np.float64).reshape(-1, 3)
+    outcomes = np.asarray(outcomes)
+
+    max_odds, min_edge, kelly_fraction = np.broadcast_arrays(np.atleast_1d(max_odds), np.atleast_1d(min_edge),
+                                                             np.atleast_1d(kelly_fraction))
+
+    selections = select_value_bets(probabilities, odds, max_odds, min_edge)
+    is_bet = selections >= 0
+
+    rows = np.arange(len(odds))
+    columns = np.maximum(selections, 0)
+    bet_odds = odds[rows, columns]
+    bet_probabilities = probabilities[rows, columns]
+
+    returns = np.where(is_bet, np.where(outcomes == selections, bet_odds - 1, -1.0), 0.0)
+
+    if method == 'kelly':
+        fractions = np.where(is_bet, calculate_stake(bet_odds, method='kelly', probability=bet_probabilities,
+                                                     kelly_fraction=kelly_fraction[:, None]), 0.0)
+        growth = np.cumprod(1 + fractions * returns, axis=1)
+        bankroll = initial_bankroll * np.hstack([np.ones((len(growth), 1)), growth])
+        stakes = fractions * bankroll[:, :-1]
+    else:
+        stakes = np.where(is_bet, calculate_stake(bet_odds, method='constant_profit',
+                                                  constant_profit=constant_profit), 0.0)
+        profits = np.cumsum(stakes * returns, axis=1)
+        bankroll = initial_bankroll + np.hstack([np.zeros((len(profits), 1)), profits])
+
+    profits = stakes * returns
+    invested = stakes.sum(axis=1)
+    profit = profits.sum(axis=1)
+    roi = np.divide(profit, invested, out=np.full_like(profit, np.nan), where=invested > 0)
+
+    return BacktestResult(bets=is_bet.sum(axis=1), invested=invested, profit=profit, roi=roi, bankroll=bankroll,
+                          stakes=stakes, profits=profits)
+
+
+def max_drawdowns(bankroll):
+    """Largest fall from a running peak, as a fraction of that peak, of each row of bankroll paths."""
+    peaks = np.maximum.accumulate(bankroll, axis=1)
+    return ((peaks - bankroll) / peaks).max(axis=1)
+
+
+def bootstrap(stakes, profits, number_of_samples=10000, confidence=0.95, seed=None, initial_bankroll=100,
+              bankrolls=None, chunk_size=2000):
+    """Bootstrap confidence intervals of ROI and maximum drawdown by resampling bets with replacement."""
+    rng = np.random.default_rng(seed)
+
+    stakes = np.asarray(stakes, dtype=np.float64)
+    profits = np.asarray(profits, dtype=np.float64)
+
+    if bankrolls is not None:
+        stakes = stakes / bankrolls
+        profits = profits / bankrolls
+
+    assert len(stakes), "There are no bets to resample"
+
+    roi = np.empty(number_of_samples)
+    max_drawdown = np.empty(number_of_samples)
+
+    for start in range(0, number_of_samples, chunk_size):
+        stop = min(start + chunk_size, number_of_samples)
+        indices = rng.integers(0, len(stakes), size=(stop - start, len(stakes)))
+
+        sample_stakes = stakes[indices]
+        sample_profits = profits[indices]
+
+        if bankrolls is None:
+            bankroll = initial_bankroll + np.cumsum(sample_profits, axis=1)
+        else:
+            bankroll = initial_bankroll * np.cumprod(1 + sample_profits, axis=1)
+            bankroll_before = np.hstack([np.full((stop - start, 1), initial_bankroll), bankroll[:, :-1]])
+            sample_stakes = sample_stakes * bankroll_before
+            sample_profits = sample_profits * bankroll_before
+
+        invested = sample_stakes.sum(axis=1)
+        roi[start:stop] = np.divide(sample_profits.sum(axis=1), invested, out=np.full(stop - start, np.nan),
+                                    where=invested > 0)
+
+        max_drawdown[start:stop] = max_drawdowns(np.hstack([np.full((stop - start, 1), initial_bankroll), bankroll]))
+
+    tails = 100 * np.array([(1 - confidence) / 2, (1 + confidence) / 2])
+
+    return BootstrapResult(roi=roi, max_drawdown=max_drawdown, roi_interval=tuple(np.nanpercentile(roi, tails)),
+                           max_drawdown_interval=tuple(np.percentile(max_drawdown, tails)))
+
+
+def get_backtest_predictions(league='F1', season='2017-2018', model_name=None):
+    """Match the lineups of a season to FIFA players and predict each match with the backtest model."""
+    if model_name is None:
+        model_name = './models/' + league + '-backtest/deep'
+
+    match_data = read_match_data(season=season, league=league)
+
+    match_data = assign_odds_to_match(match_data, read_all_football_data(league=league))
+
+    player_data = read_player_data(season=season)
+
+    player_index = PlayerIndex(player_data)
+
+    match_cache = PlayerMatchCache()
 
     errors = []
 
@@ -96,7 +234,9 @@ def main():
                                                                                      'ALL'][
                                                                                      match['info']['home team']],
                                                                                  match['info']['season'],
-                                                                                 player_data, cached_players)
+                                                                                 player_data, cached_players,
+                                                                                 player_index=player_index,
+                                                                                 match_cache=match_cache)
 
             away_players_matched, cached_players = match_lineups_to_fifa_players(match['info']['away lineup names'],
                                                                                  match['info']['away lineup raw names'],
@@ -107,7 +247,9 @@ def main():
                                                                                      'ALL'][
                                                                                      match['info']['away team']],
                                                                                  match['info']['season'],
-                                                                                 player_data, cached_players)
+                                                                                 player_data, cached_players,
+                                                                                 player_index=player_index,
+                                                                                 match_cache=match_cache)
 
             home_feature_vector = create_feature_vector_from_players(home_players_matched)
             away_feature_vector = create_feature_vector_from_players(away_players_matched)
@@ -121,12 +263,207 @@ def main():
             print(exception)
             errors.append(match['match number'])
 
+    match_cache.close()
+
     feature_vectors = np.vstack((x for x in feature_vectors))
 
-    probabilities = net.predict(feature_vectors, model_name='./models/' + league + '-backtest/deep')
+    probabilities = load_predictor(model_name).predict(feature_vectors)
 
     match_data = [match for match in match_data if match['match number'] not in errors]
 
+    return match_data, probabilities
+
+
+def get_backtest_arrays(match_data):
+    """Matches x 3 bookmaker odds and the result code of every match, NaN odds where none were found."""
+    odds = np.array([[match['info'].get('home odds', np.nan), match['info'].get('draw odds', np.nan),
+                      match['info'].get('away odds', np.nan)] for match in match_data], dtype=np.float64)
+    outcomes = results_from_scorelines(np.array([match['info']['home goals'] for match in match_data]),
+                                       np.array([match['info']['away goals'] for match in match_data]))
+    return odds.reshape(-1, 3), outcomes
+
+
+def backtest_predictions_path(league, season):
+    return os.path.join(BACKTEST_PREDICTIONS_DIRECTORY, '{}-{}.npz'.format(league, season))
+
+
+def backtest_source_modified_times(league, model_name):
+    """Modification times of the checkpoint, weights, lineups, odds and player data behind backtest predictions."""
+    paths = [model_name + '.index', model_name + '.npz', match_data_path(league), PLAYER_DATA_PATH]
+    paths += sorted(glob.glob(football_data_directory(league) + '/*.csv'))
+    return {path: os.path.getmtime(path) if os.path.exists(path) else None for path in paths}
+
+
+def get_cached_backtest_arrays(league='F1', season='2017-2018', model_name=None, path=None):
+    """Probabilities, odds and outcomes of a season, read from an .npz file unless its model or sources changed."""
+    if model_name is None:
+        model_name = './models/' + league + '-backtest/deep'
+    if path is None:
+        path = backtest_predictions_path(league, season)
+
+    sources = json.dumps(backtest_source_modified_times(league, model_name), sort_keys=True)
+
+    if os.path.exists(path):
+        cached = np.load(path)
+        if ('sources' in cached.files and str(cached['model_name']) == model_name
+                and str(cached['sources']) == sources):
+            return cached['probabilities'], cached['odds'], cached['outcomes']
+
+    match_data, probabilities = get_backtest_predictions(league=league, season=season, model_name=model_name)
+    odds, outcomes = get_backtest_arrays(match_data)
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    np.savez(path, probabilities=probabilities, odds=odds, outcomes=outcomes, model_name=model_name,
+             sources=sources)
+
+    return probabilities, odds, outcomes
+
+
+def _sweep_chunk(arguments):
+    probabilities, odds, outcomes, method, max_odds, min_edge, kelly_fraction = arguments
+    result = backtest(probabilities, odds, outcomes, max_odds=max_odds, min_edge=min_edge, method=method,
+                      kelly_fraction=kelly_fraction)
+    return pd.DataFrame({'method': method, 'max odds': max_odds, 'min edge': min_edge,
+                         'kelly fraction': kelly_fraction if method == 'kelly' else np.nan, 'bets': result.bets,
+                         'invested': result.invested, 'profit': result.profit, 'roi': result.roi,
+                         'final bankroll': result.bankroll[:, -1],
+                         'lowest bankroll': result.bankroll.min(axis=1)})
+
+
+def sweep(probabilities, odds, outcomes, max_odds, min_edge, methods=('kelly',), kelly_fractions=(1.0,),
+          processes=None, chunk_size=5000, min_bets=0):
+    """Backtest every combination of the parameter grids over a process pool, ranked by ROI."""
+    chunks = []
+    for method in methods:
+        grid = itertools.product(max_odds, min_edge, kelly_fractions if method == 'kelly' else [1.0])
+        combinations = np.array(list(grid), dtype=np.float64).reshape(-1, 3)
+        for start in range(0, len(combinations), chunk_size):
+            chunk = combinations[start:start + chunk_size]
+            chunks.append((probabilities, odds, outcomes, method, chunk[:, 0], chunk[:, 1], chunk[:, 2]))
+
+    if processes == 1:
+        results = [_sweep_chunk(chunk) for chunk in chunks]
+    else:
+        with Pool(processes=processes) as pool:
+            results = pool.map(_sweep_chunk, chunks)
+
+    results = pd.concat(results, ignore_index=True)
+    results = results[results['bets'] >= min_bets]
+
+    return results.sort_values(by=['roi', 'profit'], ascending=False, na_position='last').reset_index(drop=True)
+
+
+def window_labels(dates, frequency='season'):
+    """First day of the season (starting in July) or month that each date falls in."""
+    assert frequency in ['season', 'month']
+    months = np.asarray(dates, dtype='datetime64[D]').astype('datetime64[M]')
+    if frequency == 'month':
+        return months.astype('datetime64[D]')
+    season_years = (months - np.timedelta64(6, 'M')).astype('datetime64[Y]')
+    return (season_years.astype('datetime64[M]') + np.timedelta64(6, 'M')).astype('datetime64[D]')
+
+
+def window_model_name(league, training_match_numbers, training_dates, training_feature_vectors, training_targets,
+                      train_kwargs):
+    """Checkpoint path keyed by a hash of the training rows and settings."""
+    window_hash = hashlib.sha1()
+    window_hash.update(np.ascontiguousarray(training_match_numbers, dtype=np.int64).tobytes())
+    window_hash.update(np.ascontiguousarray(training_dates, dtype='datetime64[D]').astype(np.int64).tobytes())
+    window_hash.update(np.ascontiguousarray(training_feature_vectors, dtype=np.int64).tobytes())
+    window_hash.update(np.ascontiguousarray(training_targets, dtype=np.float64).tobytes())
+    window_hash.update(json.dumps(train_kwargs, sort_keys=True).encode())
+    return os.path.join(WALK_FORWARD_MODEL_DIRECTORY, league + '-walk-forward', window_hash.hexdigest()[:16], 'deep')
+
+
+def _train_window(arguments):
+    model_name, directory, leagues, training_rows, validation_size, train_kwargs = arguments
+
+    from fifa_ratings_predictor.model import NeuralNet, export_weights
+
+    dataset = TrainingDataset.from_store(FeatureStore(directory), leagues=leagues)
+    training_data, validation_data = TrainingDataset(dataset.feature_vectors, dataset.targets,
+                                                     training_rows).split(validation_size)
+
+    os.makedirs(os.path.dirname(model_name), exist_ok=True)
+    NeuralNet().train_on_dataset(training_data, validation_data, model_name, **train_kwargs)
+
+    assert os.path.exists(model_name + '.index'), "No checkpoint was saved for {}".format(model_name)
+
+    export_weights(model_name)
+
+    return model_name
+
+
+def walk_forward(league, start, frequency='season', leagues=None, directory=FEATURE_STORE_DIRECTORY,
+                 processes=None, validation_size=100, **train_kwargs):
+    """Predict every season or month window of a league from a model trained on all matches before it."""
+    leagues = [league] if leagues is None else leagues
+
+    store = FeatureStore(directory)
+    partitions = store.partitions(leagues=leagues)
+
+    assert partitions, "No feature vectors in the store for {}".format(leagues)
+
+    feature_vectors, targets, match_numbers, dates, goals = store.read(
+        leagues=leagues, columns=('feature-vectors', 'targets', 'match-numbers', 'dates', 'goals'))
+    row_leagues = np.concatenate([
+        np.full(len(np.load(store.partition_path(partition_league, season, 'match-numbers'), mmap_mode='r')),
+                partition_league) for partition_league, season in partitions])
+
+    valid = ~np.isnan(targets).any(axis=1)
+    labels = window_labels(dates, frequency)
+    windows = np.unique(labels[(row_leagues == league) & (labels >= np.datetime64(start, 'D'))])
+
+    jobs = []
+    for window in windows:
+        training_rows = np.flatnonzero(valid & (dates < window))
+        training_rows = training_rows[np.argsort(dates[training_rows], kind='stable')]
+        test_rows = np.flatnonzero(valid & (row_leagues == league) & (labels == window))
+
+        if len(training_rows) <= validation_size or not len(test_rows):
+            continue
+
+        model_name = window_model_name(league, match_numbers[training_rows], dates[training_rows],
+                                       feature_vectors[training_rows], targets[training_rows],
+                                       dict(train_kwargs, leagues=leagues, validation_size=validation_size))
+        jobs.append((model_name, directory, leagues, training_rows, validation_size, train_kwargs, test_rows))
+
+    untrained = [job[:-1] for job in jobs if not os.path.exists(job[0] + '.index')]
+    print('{} windows, {} to train'.format(len(jobs), len(untrained)))
+
+    if untrained:
+        with Pool(processes=processes, maxtasksperchild=1) as pool:
+            for model_name in pool.imap_unordered(_train_window, untrained):
+                print('Trained', model_name)
+
+    dataset = TrainingDataset.from_store(store, leagues=leagues)
+
+    probabilities = []
+    rows = []
+    for model_name, _, _, _, _, _, test_rows in jobs:
+        feature_vectors, _ = dataset.batch(test_rows)
+        probabilities.append(load_predictor(model_name).predict(feature_vectors))
+        rows.append(test_rows)
+
+    probabilities = np.concatenate(probabilities).reshape(-1, 3)
+    rows = np.concatenate(rows).astype(int)
+    order = np.argsort(dates[rows], kind='stable')
+    rows = rows[order]
+
+    outcomes = results_from_scorelines(goals[rows, 0], goals[rows, 1])
+
+    return probabilities[order], targets[rows], outcomes, dates[rows]
+
+
+def main(league='F1', season='2017-2018'):
+    bet_tracker = BetTracker()
+
+    match_data, probabilities = get_backtest_predictions(league=league, season=season)
+
+    bank = [100]
+
+    all_odds = []
+
     for match, probability in zip(match_data, probabilities):
 
         # print(match['info']['date'], match['info']['home team'], match['info']['away team'])
@@ -139,7 +476,8 @@ def main():
         all_odds.append((pred_home_odds, home_odds))
         all_odds.append((pred_away_odds, away_odds))
 
-        if pred_home_odds < home_odds < 3.2 and 0.02 <= probability[0] - 1 / home_odds:
+        if pred_home_odds < home_odds < constants.VALUE_BET_MAX_ODDS and \
+                constants.VALUE_BET_MIN_EDGE <= probability[0] - 1 / home_odds:
             stake = calculate_stake(home_odds, probability=1 / pred_home_odds, method='kelly',
                                     constant_profit=20) * bet_tracker.bankroll
             profit = stake * home_odds - stake
@@ -151,7 +489,8 @@ def main():
             else:
                 bet_tracker.bet_lost()
             bank.append(bet_tracker.bankroll)
-        elif pred_away_odds < away_odds < 3.2 and 0.02 <= probability[2] - 1 / away_odds:
+        elif pred_away_odds < away_odds < constants.VALUE_BET_MAX_ODDS and \
+                constants.VALUE_BET_MIN_EDGE <= probability[2] - 1 / away_odds:
             stake = calculate_stake(away_odds, probability=1 / pred_away_odds, method='kelly',
                                     constant_profit=20) * bet_tracker.bankroll
             profit = stake * away_odds - stake
@@ -199,4 +538,153 @@ def plot_backtest(bankroll, roi, plot_title, name='graph.png'):
 
 
 if __name__ == '__main__':
-    tracker, bankroll, odds = main()
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '--league',
+        type=str,
+        default='F1',
+        help="""\
+      The football-data league code to backtest.\
+      """
+    )
+    parser.add_argument(
+        '--season',
+        type=str,
+        default='2017-2018',
+        help="""\
+      The season to backtest.\
+      """
+    )
+    parser.add_argument(
+        '--sweep',
+        action='store_true',
+        help="""\
+      Backtest a grid of betting thresholds and staking methods instead of the default rule.\
+      """
+    )
+    parser.add_argument(
+        '--walk-forward',
+        action='store_true',
+        help="""\
+      Retrain on all earlier matches before each window from --start and backtest the windows as one.\
+      """
+    )
+    parser.add_argument(
+        '--start',
+        type=str,
+        default='2015-07-01',
+        help="""\
+      First day of the first walk-forward window.\
+      """
+    )
+    parser.add_argument(
+        '--frequency',
+        type=str,
+        default='season',
+        choices=['season', 'month'],
+        help="""\
+      Length of the walk-forward windows.\
+      """
+    )
+    parser.add_argument(
+        '--max-odds',
+        type=float,
+        nargs='+',
+        default=np.round(np.arange(1.5, 5.01, 0.1), 2).tolist(),
+        help="""\
+      Maximum odds to bet at, for the sweep.\
+      """
+    )
+    parser.add_argument(
+        '--min-edge',
+        type=float,
+        nargs='+',
+        default=np.round(np.arange(0, 0.1001, 0.005), 3).tolist(),
+        help="""\
+      Minimum edge over the bookmaker's implied probability, for the sweep.\
+      """
+    )
+    parser.add_argument(
+        '--methods',
+        type=str,
+        nargs='+',
+        default=['kelly', 'constant_profit'],
+        choices=['kelly', 'constant_profit'],
+        help="""\
+      Staking methods, for the sweep.\
+      """
+    )
+    parser.add_argument(
+        '--kelly-fractions',
+        type=float,
+        nargs='+',
+        default=[0.1, 0.25, 0.5, 1.0],
+        help="""\
+      Fractions of the Kelly stake, for the sweep.\
+      """
+    )
+    parser.add_argument(
+        '--min-bets',
+        type=int,
+        default=20,
+        help="""\
+      Only rank sweep combinations that place at least this many bets.\
+      """
+    )
+    parser.add_argument(
+        '--processes',
+        type=int,
+        default=None,
+        help="""\
+      Number of worker processes for the sweep or walk-forward training, defaults to the number of cores.\
+      """
+    )
+    parser.add_argument(
+        '--bootstrap',
+        type=int,
+        default=0,
+        help="""\
+      Number of bootstrap samples for ROI and drawdown confidence intervals, none if 0.\
+      """
+    )
+    parser.add_argument(
+        '--output',
+        type=str,
+        default=None,
+        help="""\
+      Where to write the ranked sweep results as csv.\
+      """
+    )
+
+    arguments = parser.parse_args()
+
+    intervals = None
+
+    if arguments.walk_forward:
+        probabilities, odds, outcomes, dates = walk_forward(arguments.league, arguments.start,
+                                                            frequency=arguments.frequency,
+                                                            processes=arguments.processes)
+        result = backtest(probabilities, odds, outcomes)
+        print('{} matches from {} to {}, {} bets'.format(len(dates), dates[0], dates[-1], result.bets[0]))
+        print('ROI: {0:.2%}, final bankroll: {1:.2f}'.format(result.roi[0], result.bankroll[0, -1]))
+        if arguments.bootstrap:
+            intervals = bootstrap(result.stakes[0], result.profits[0], number_of_samples=arguments.bootstrap,
+                                  bankrolls=result.bankroll[0, :-1])
+    elif arguments.sweep:
+        probabilities, odds, outcomes = get_cached_backtest_arrays(league=arguments.league, season=arguments.season)
+        results = sweep(probabilities, odds, outcomes, arguments.max_odds, arguments.min_edge,
+                        methods=arguments.methods, kelly_fractions=arguments.kelly_fractions,
+                        processes=arguments.processes, min_bets=arguments.min_bets)
+        if arguments.output is not None:
+            results.to_csv(arguments.output, index=False)
+        print(results.head(20).to_string())
+    else:
+        tracker, bankroll, odds = main(league=arguments.league, season=arguments.season)
+        print('ROI: {0:.2%}'.format(tracker.roi))
+        if arguments.bootstrap:
+            intervals = tracker.bootstrap(number_of_samples=arguments.bootstrap)
+
+    if intervals is not None:
+        print('95% ROI interval: {0:.2%} to {1:.2%}'.format(*intervals.roi_interval))
+        print('95% max drawdown interval: {0:.2%} to {1:.2%}'.format(*intervals.max_drawdown_interval))
@@ -17,7 +17,8 @@ from oauth2client.service_account import ServiceAccountCredentials
 
 from fifa_ratings_predictor.one_match_simulator import one_match_simulator
 from fifa_ratings_predictor.backtesting import calculate_stake
-from fifa_ratings_predictor.matching import match_lineups_to_fifa_players, create_feature_vector_from_players
+from fifa_ratings_predictor.matching import PlayerIndex, PlayerMatchCache, match_lineups_to_fifa_players, \
+    create_feature_vector_from_players
 from fifa_ratings_predictor.data_methods import read_player_data
 import fifa_ratings_predictor.constants as constants
 
@@ -251,6 +252,10 @@ if __name__ == '__main__':
 
     del data[gui_to_delete]
 
+    player_index = PlayerIndex(data)
+
+    match_cache = PlayerMatchCache()
+
     matches = get_lineups_from_flashscores()
 
     for match in matches:
@@ -263,14 +268,16 @@ if __name__ == '__main__':
                                                                              match['home_lineup_numbers'],
                                                                              match['home_lineup_nationalities'],
                                                                              player_home_team, '2017-2018', data,
-                                                                             cached_players)
+                                                                             cached_players, player_index=player_index,
+                                                                             match_cache=match_cache)
 
         away_players_matched, cached_players = match_lineups_to_fifa_players(match['away_lineup_names'],
                                                                              match['away_lineup_names'],
                                                                              match['away_lineup_numbers'],
                                                                              match['away_lineup_nationalities'],
                                                                              player_away_team, '2017-2018', data,
-                                                                             cached_players)
+                                                                             cached_players, player_index=player_index,
+                                                                             match_cache=match_cache)
 
         home_feature_vector = create_feature_vector_from_players(home_players_matched)
         away_feature_vector = create_feature_vector_from_players(away_players_matched)
@@ -294,8 +301,8 @@ if __name__ == '__main__':
         print(my_probabilities)
         print(bookies_probabilities)
 
-        if 1 / my_probabilities[0] < 1 / bookies_probabilities[0] < 3.2 and 0.02 <= my_probabilities[0] - \
-                bookies_probabilities[0]:
+        if 1 / my_probabilities[0] < 1 / bookies_probabilities[0] < constants.VALUE_BET_MAX_ODDS and \
+                constants.VALUE_BET_MIN_EDGE <= my_probabilities[0] - bookies_probabilities[0]:
             stake = calculate_stake(1 / bookies_probabilities[0], probability=my_probabilities[0], method='kelly')
             selection = 1
             my_odds = 1 / my_probabilities[0]
@@ -304,8 +311,8 @@ if __name__ == '__main__':
                          selection, my_odds, bookies_odds, stake]
             write_to_google_sheet(sheet_row)
 
-        elif 1 / my_probabilities[2] < 1 / bookies_probabilities[2] < 3.2 and 0.02 <= my_probabilities[2] - \
-                bookies_probabilities[2]:
+        elif 1 / my_probabilities[2] < 1 / bookies_probabilities[2] < constants.VALUE_BET_MAX_ODDS and \
+                constants.VALUE_BET_MIN_EDGE <= my_probabilities[2] - bookies_probabilities[2]:
             stake = calculate_stake(1 / bookies_probabilities[2], probability=my_probabilities[2], method='kelly')
             selection = 2
             my_odds = 1 / my_probabilities[2]
@@ -633,3 +633,6 @@ NUMBER_PROBABILITY = 0.2
 NATIONALITY_PROBABILITY = 0.15
 NAME_PROBABILITY = 0.4
 SEASON_PROBABILITY = 0.1
+
+VALUE_BET_MAX_ODDS = 3.2
+VALUE_BET_MIN_EDGE = 0.02
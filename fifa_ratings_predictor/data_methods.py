@@ -1,6 +1,9 @@
 import datetime
 import glob
 import json
+import os
+import pickle
+import tempfile
 
 import fifa_ratings_predictor.constants as constants
 import numpy as np
@@ -8,8 +11,49 @@ import pandas as pd
 from slugify import slugify
 
 
-def read_player_data(season=None):
-    with open("./data/player-data/players-by-team.json") as json_file:
+PLAYER_DATA_PATH = "./data/player-data/players-by-team.json"
+COMPILED_PLAYER_DATA_DIRECTORY = "./data/player-data/compiled"
+
+
+def write_atomically(path, write):
+    """Call write(temporary_path) for a file beside path, then move it over path in one step.
+
+    Readers in other processes see either the old file or the complete new one, never a
+    partly written file.
+    """
+    directory, name = os.path.split(path)
+    file_descriptor, temporary_path = tempfile.mkstemp(
+        dir=directory or ".", prefix="." + name + ".", suffix=os.path.splitext(name)[1]
+    )
+    os.close(file_descriptor)
+
+    try:
+        write(temporary_path)
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+
+def write_json(path, data):
+    def write(temporary_path):
+        with open(temporary_path, "w") as json_file:
+            json.dump(data, json_file)
+
+    write_atomically(path, write)
+
+
+def compile_player_data(
+    json_path=PLAYER_DATA_PATH, output_directory=COMPILED_PLAYER_DATA_DIRECTORY
+):
+    """Write the player json to one NumPy structured array per season.
+
+    Guids, general positions and seasons are resolved once here, so reading a season back
+    is a memory mapped load of its partition. A manifest records the json's modification
+    time so read_player_data can tell when the partitions are stale.
+    """
+    with open(json_path) as json_file:
         data = json.load(json_file)
 
     data = assign_guids(data)
@@ -18,37 +62,163 @@ def read_player_data(season=None):
         player["general position"] = assign_general_position(player["position"])
         player["season"] = assign_season_to_player(player["url"])
 
-    if season is not None:
-        data = {
-            guid: player_details
-            for guid, player_details in data.items()
-            if player_details["season"] == season
-        }
+    players = list(data.values())
+
+    fields = []
+    for player in players:
+        fields.extend(field for field in player if field not in fields)
+
+    dtype = []
+    for field in fields:
+        values = [player.get(field) for player in players]
+        if all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+            dtype.append((field, np.int64))
+        else:
+            width = max(len(str(value)) for value in values)
+            dtype.append((field, "U{}".format(max(width, 1))))
+
+    records = np.array(
+        [
+            tuple(
+                player.get(field) if kind == np.int64 else str(player.get(field))
+                for field, kind in dtype
+            )
+            for player in players
+        ],
+        dtype=dtype,
+    )
+
+    os.makedirs(output_directory, exist_ok=True)
+
+    seasons = sorted(set(records["season"].tolist()))
+    for season in seasons:
+        season_records = records[records["season"] == season]
+        write_atomically(
+            os.path.join(output_directory, season + ".npy"),
+            lambda temporary_path: np.save(temporary_path, season_records),
+        )
+
+    manifest = {
+        "source modified time": os.path.getmtime(json_path),
+        "seasons": seasons,
+    }
+    write_json(os.path.join(output_directory, "manifest.json"), manifest)
+
+    return manifest
+
+
+def load_player_data_manifest(
+    json_path=PLAYER_DATA_PATH, output_directory=COMPILED_PLAYER_DATA_DIRECTORY
+):
+    """Return the compiled player data manifest, recompiling if the json has changed."""
+    manifest_path = os.path.join(output_directory, "manifest.json")
+
+    try:
+        with open(manifest_path) as json_file:
+            manifest = json.load(json_file)
+    except (IOError, ValueError):
+        manifest = None
+
+    if (
+        manifest is None
+        or manifest["source modified time"] != os.path.getmtime(json_path)
+    ):
+        manifest = compile_player_data(json_path, output_directory)
+
+    return manifest
+
+
+def read_player_data(season=None):
+    manifest = load_player_data_manifest()
+
+    seasons = manifest["seasons"] if season is None else [season]
+
+    data = {}
+    for season_to_read in seasons:
+        path = os.path.join(COMPILED_PLAYER_DATA_DIRECTORY, season_to_read + ".npy")
+        if not os.path.exists(path):
+            continue
+
+        records = np.load(path, mmap_mode="r")
+        fields = records.dtype.names
+
+        for values in records.tolist():
+            player = dict(zip(fields, values))
+            data[player["guid"]] = player
+
+    if len(seasons) > 1:
+        data = dict(sorted(data.items()))
 
     assert data, "No match lineups to return, have you selected a valid season?"
 
     return data
 
 
-def read_match_data(season=None, sort=True, league="E0"):
-    filen = "./data/lineup-data/" + league + "/match-lineups.json"
+def match_data_path(league):
+    return "./data/lineup-data/" + league + "/match-lineups.json"
+
+
+def compile_match_data(league="E0"):
+    """Parse a league's match lineups once and pickle them with season and date resolved.
+
+    Matches keep their json order, and the pickle also holds the positions of each
+    season's matches so a season can be selected without scanning every match.
+    """
+    filen = match_data_path(league)
     with open(filen) as json_file:
         data = json.load(json_file)
 
-    for match in data:
-        match["info"]["season"] = assign_season_to_match(match["info"]["date"])
+    season_positions = {}
+    for position, match in enumerate(data):
+        match["info"]["datetime"] = convert_date_to_datetime_object(
+            match["info"]["date"]
+        )
+        match["info"]["season"] = assign_season_to_datetime(match["info"]["datetime"])
+        season_positions.setdefault(match["info"]["season"], []).append(position)
+
+    compiled = {
+        "source modified time": os.path.getmtime(filen),
+        "season positions": season_positions,
+        "matches": data,
+    }
+
+    def write(temporary_path):
+        with open(temporary_path, "wb") as pickle_file:
+            pickle.dump(compiled, pickle_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    write_atomically(os.path.splitext(filen)[0] + ".pickle", write)
+
+    return compiled
+
+
+def load_compiled_match_data(league="E0"):
+    """Return a league's compiled match data, recompiling if the json has changed."""
+    filen = match_data_path(league)
+
+    try:
+        with open(os.path.splitext(filen)[0] + ".pickle", "rb") as pickle_file:
+            compiled = pickle.load(pickle_file)
+    except (IOError, EOFError, pickle.UnpicklingError):
+        compiled = None
+
+    if (
+        compiled is None
+        or compiled["source modified time"] != os.path.getmtime(filen)
+    ):
+        compiled = compile_match_data(league)
+
+    return compiled
+
+
+def read_match_data(season=None, sort=True, league="E0"):
+    compiled = load_compiled_match_data(league)
 
-    for match in data:
-        match["info"]["season"] = assign_season_to_match(match["info"]["date"])
+    data = compiled["matches"]
 
     if season is not None:
-        data = [match for match in data if match["info"]["season"] == season]
+        data = [data[position] for position in compiled["season positions"].get(season, [])]
 
     if sort:
-        for match in data:
-            match["info"]["datetime"] = convert_date_to_datetime_object(
-                match["info"]["date"]
-            )
         data = sorted(data, key=lambda x: x["info"]["datetime"])
 
     assert data, "No match lineups to return, have you selected a valid season?"
@@ -70,17 +240,99 @@ def read_fixtures_data(filepath="./data/fixtures/E0/18-19-fixtures.json"):
     return fixtures
 
 
-def read_all_football_data(league):
-    path = "./data/football-data/" + league
+FOOTBALL_DATA_COLUMNS = [
+    "Div",
+    "Date",
+    "HomeTeam",
+    "AwayTeam",
+    "FTHG",
+    "FTAG",
+    "PSH",
+    "PSD",
+    "PSA",
+]
+
+
+def football_data_directory(league):
+    return "./data/football-data/" + league
+
+
+def ingest_football_data(league):
+    """Convert a league's new or changed football-data CSVs to typed Feather partitions.
+
+    Each CSV becomes one partition holding only FOOTBALL_DATA_COLUMNS with parsed dates.
+    The manifest records each source's modification time and season, so unchanged CSVs
+    are never re-read.
+    """
+    path = football_data_directory(league)
+    store_directory = os.path.join(path, "store")
+    manifest_path = os.path.join(store_directory, "manifest.json")
+
+    os.makedirs(store_directory, exist_ok=True)
+
+    try:
+        with open(manifest_path) as json_file:
+            manifest = json.load(json_file)
+    except (IOError, ValueError):
+        manifest = {}
+
     all_files = glob.glob(path + "/*.csv")
-    list_ = []
-    for file_ in all_files:
-        df = pd.read_csv(file_)
-        list_.append(df)
-    df = pd.concat(list_, sort=False)
+    sources = {os.path.basename(file_): file_ for file_ in all_files}
+
+    changed = False
+
+    for source in list(manifest):
+        if source not in sources:
+            del manifest[source]
+            changed = True
+
+    for source, file_ in sorted(sources.items()):
+        modified_time = os.path.getmtime(file_)
+        partition = os.path.splitext(source)[0] + ".feather"
+
+        entry = manifest.get(source)
+        if (
+            entry is not None
+            and entry["source modified time"] == modified_time
+            and os.path.exists(os.path.join(store_directory, partition))
+        ):
+            continue
+
+        df = pd.read_csv(file_, usecols=lambda column: column in FOOTBALL_DATA_COLUMNS)
+        df = df[~df["HomeTeam"].isnull()]
+        df = df[~df["AwayTeam"].isnull()]
+        df["Date"] = parse_football_data_dates(df["Date"])
+        for column in FOOTBALL_DATA_COLUMNS[4:]:
+            if column in df.columns:
+                df[column] = pd.to_numeric(df[column], errors="coerce").astype(np.float64)
+        df = df.reset_index(drop=True)
+
+        write_atomically(os.path.join(store_directory, partition), df.to_feather)
+
+        seasons = df["Date"].dropna().map(assign_season_to_datetime)
+        manifest[source] = {
+            "source modified time": modified_time,
+            "partition": partition,
+            "season": seasons.mode()[0] if len(seasons) else None,
+        }
+        changed = True
+
+    if changed:
+        write_json(manifest_path, manifest)
+
+    return manifest
+
 
-    df = df[~df["HomeTeam"].isnull()]
-    df = df[~df["AwayTeam"].isnull()]
+def read_all_football_data(league, seasons=None):
+    manifest = ingest_football_data(league)
+    store_directory = os.path.join(football_data_directory(league), "store")
+
+    list_ = [
+        pd.read_feather(os.path.join(store_directory, entry["partition"]))
+        for _, entry in sorted(manifest.items())
+        if seasons is None or entry["season"] in seasons
+    ]
+    df = pd.concat(list_, sort=False, ignore_index=True)
 
     return df
 
@@ -95,9 +347,10 @@ def convert_date_to_datetime_object(date, string_format="%d %B %Y"):
 
 
 def assign_season_to_match(date):
+    return assign_season_to_datetime(convert_date_to_datetime_object(date))
 
-    date = convert_date_to_datetime_object(date)
 
+def assign_season_to_datetime(date):
     year = date.year
     month = date.month
     if month in [7, 8, 9, 10, 11, 12]:
@@ -124,33 +377,92 @@ def assign_general_position(position):
     return constants.EXACT_TO_GENERIC[position]
 
 
+def normalise_football_data(fd):
+    """Add the slugified team and parsed date columns that odds are joined on."""
+    fd = fd.copy()
+
+    team_slugs = {
+        team: slugify(team)
+        for team in set(fd["HomeTeam"].tolist()) | set(fd["AwayTeam"].tolist())
+    }
+    fd["home slug"] = fd["HomeTeam"].map(team_slugs)
+    fd["away slug"] = fd["AwayTeam"].map(team_slugs)
+
+    fd["match date"] = parse_football_data_dates(fd["Date"])
+
+    return fd
+
+
+def parse_football_data_dates(dates):
+    if pd.api.types.is_datetime64_any_dtype(dates):
+        return dates
+
+    match_dates = pd.to_datetime(dates, format="%d/%m/%y", errors="coerce")
+    four_digit_years = match_dates.isnull()
+    match_dates[four_digit_years] = pd.to_datetime(
+        dates[four_digit_years], format="%d/%m/%Y", errors="coerce"
+    )
+    return match_dates
+
+
 def assign_odds_to_match(matchlineups, fd):
+    """Attach Pinnacle odds to each match with one merge on (home team, away team, date).
+
+    Matches without a football-data row are left without odds and reported.
+    """
     league = fd["Div"].tolist()[0]
-    for match in matchlineups:
-        try:
-            home_team = constants.FOOTBALL_DATA_TEAM_MAPPINGS[league][
-                match["info"]["home team"]
-            ]
-            away_team = constants.FOOTBALL_DATA_TEAM_MAPPINGS[league][
-                match["info"]["away team"]
-            ]
-
-        except KeyError:
-            home_team = None
-            away_team = None
-
-        for index, row in fd.iterrows():
-
-            if home_team == slugify(row["HomeTeam"]) and away_team == slugify(
-                row["AwayTeam"]
-            ):
-                if datetime.datetime.strptime(
-                    match["info"]["date"], "%d %B %Y"
-                ) == datetime.datetime.strptime(row["Date"], "%d/%m/%y"):
-                    match["info"]["home odds"] = row["PSH"]
-                    match["info"]["draw odds"] = row["PSD"]
-                    match["info"]["away odds"] = row["PSA"]
-                    break
+
+    if "match date" not in fd.columns:
+        fd = normalise_football_data(fd)
+
+    join_columns = ["home slug", "away slug", "match date"]
+
+    odds = fd[join_columns + ["PSH", "PSD", "PSA"]].drop_duplicates(
+        subset=join_columns, keep="first"
+    )
+
+    team_mappings = constants.FOOTBALL_DATA_TEAM_MAPPINGS.get(league, {})
+
+    lineups = pd.DataFrame(
+        {
+            "home slug": [
+                team_mappings.get(match["info"]["home team"]) for match in matchlineups
+            ],
+            "away slug": [
+                team_mappings.get(match["info"]["away team"]) for match in matchlineups
+            ],
+            "match date": [
+                match["info"].get("datetime")
+                or convert_date_to_datetime_object(match["info"]["date"])
+                for match in matchlineups
+            ],
+        }
+    )
+
+    merged = lineups.merge(odds, on=join_columns, how="left", indicator=True)
+
+    unmatched = []
+    for match, (home_odds, draw_odds, away_odds, found) in zip(
+        matchlineups,
+        merged[["PSH", "PSD", "PSA", "_merge"]].itertuples(index=False, name=None),
+    ):
+        if found == "both":
+            match["info"]["home odds"] = home_odds
+            match["info"]["draw odds"] = draw_odds
+            match["info"]["away odds"] = away_odds
+        else:
+            unmatched.append(match)
+
+    if unmatched:
+        print(
+            "No odds found for {} of {} matches".format(
+                len(unmatched), len(matchlineups)
+            )
+        )
+        for match in unmatched:
+            print(
+                match["info"]["date"], match["info"]["home team"], match["info"]["away team"]
+            )
 
     return matchlineups
 
@@ -159,6 +471,62 @@ def get_goals(match):
     return match["info"]["home goals"], match["info"]["away goals"]
 
 
+def get_played_matches(match_data):
+    """Teams and goals of each match, in the played_matches format of SeasonSimulator."""
+    played_matches = []
+    for match in match_data:
+        home_goals, away_goals = get_goals(match)
+        played_matches.append(
+            {
+                "home team": match["info"]["home team"],
+                "away team": match["info"]["away team"],
+                "home goals": int(home_goals),
+                "away goals": int(away_goals),
+            }
+        )
+    return played_matches
+
+
+def get_played_matches_from_football_data(fd, season=None):
+    """Teams and full-time goals of each played football-data match of a season, named as in the fixtures.
+
+    Rows without a full-time score yet are skipped. If no season is given the data must
+    hold a single season, since read_all_football_data returns every season by default.
+    """
+    league = fd["Div"].tolist()[0]
+    team_mappings = {
+        football_data_team: team
+        for team, football_data_team in constants.FOOTBALL_DATA_TEAM_MAPPINGS.get(league, {}).items()
+    }
+
+    if "home slug" not in fd.columns:
+        fd = normalise_football_data(fd)
+
+    seasons = fd["match date"].map(
+        lambda date: assign_season_to_datetime(date) if pd.notnull(date) else None
+    )
+    if season is None:
+        assert seasons.nunique() == 1, "Football data holds seasons {}, choose one".format(
+            sorted(seasons.dropna().unique())
+        )
+    else:
+        fd = fd[seasons == season]
+
+    fd = fd.dropna(subset=["FTHG", "FTAG"])
+
+    return [
+        {
+            "home team": team_mappings.get(home_slug, home_slug),
+            "away team": team_mappings.get(away_slug, away_slug),
+            "home goals": int(home_goals),
+            "away goals": int(away_goals),
+        }
+        for home_slug, away_slug, home_goals, away_goals in fd[
+            ["home slug", "away slug", "FTHG", "FTAG"]
+        ].itertuples(index=False, name=None)
+    ]
+
+
 def get_season(match):
     return match["info"]["season"]
 
@@ -0,0 +1,411 @@
+import argparse
+import hashlib
+import json
+import os
+from multiprocessing import Pool
+
+import numpy as np
+
+from fifa_ratings_predictor.data_methods import (
+    assign_odds_to_match,
+    get_goals,
+    get_lineup_names,
+    get_lineup_nationalities,
+    get_lineup_numbers,
+    get_match_odds,
+    get_season,
+    get_teams,
+    ingest_football_data,
+    load_compiled_match_data,
+    load_player_data_manifest,
+    normalise_features,
+    read_all_football_data,
+    read_match_data,
+    read_player_data,
+)
+from fifa_ratings_predictor.matching import (
+    PlayerIndex,
+    PlayerMatchCache,
+    create_feature_vector_from_players,
+    match_lineups_to_fifa_players,
+)
+
+FEATURE_STORE_DIRECTORY = "./data/feature-store"
+
+
+class FeatureStore:
+    """Per-match feature vectors and targets saved as .npy files per (league, season).
+
+    Every row is keyed by its match number. The manifest keeps a fingerprint of each match
+    that has been processed, including those that failed, so an update only rebuilds
+    matches that are new or whose lineups or odds have changed. It also records the
+    modification time of the player data each partition was built from, and a partition
+    is rebuilt in full when the player data changes.
+    """
+
+    COLUMNS = ("feature-vectors", "targets", "match-numbers", "dates", "goals")
+
+    def __init__(self, directory=FEATURE_STORE_DIRECTORY):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, "manifest.json")
+
+        try:
+            with open(self.manifest_path) as json_file:
+                self.manifest = json.load(json_file)
+        except (IOError, ValueError):
+            self.manifest = {}
+
+    @staticmethod
+    def partition_key(league, season):
+        return league + "/" + season
+
+    def partition_path(self, league, season, name):
+        return os.path.join(self.directory, league, season + "-" + name + ".npy")
+
+    def fingerprints(self, league, season, player_data_modified_time=None):
+        entry = self.manifest.get(self.partition_key(league, season), {})
+        if entry.get("player data modified time") != player_data_modified_time:
+            return {}
+        return entry.get("fingerprints", {})
+
+    def read_partition(self, league, season):
+        paths = [self.partition_path(league, season, column) for column in self.COLUMNS]
+        if self.partition_key(league, season) not in self.manifest or not all(map(os.path.exists, paths)):
+            return None
+        return {column: np.load(path) for column, path in zip(self.COLUMNS, paths)}
+
+    def update_partition(self, league, season, rows, fingerprints, errors, player_data_modified_time=None):
+        """Replace or append the given rows, keyed by match number, and record fingerprints."""
+        os.makedirs(os.path.join(self.directory, league), exist_ok=True)
+
+        existing = self.read_partition(league, season)
+        if existing is not None:
+            keep = ~np.isin(existing["match-numbers"], rows["match-numbers"])
+            keep &= ~np.isin(existing["match-numbers"], errors)
+            rows = {column: np.concatenate([existing[column][keep], rows[column]]) for column in self.COLUMNS}
+
+        order = np.lexsort((rows["match-numbers"], rows["dates"]))
+        for column in self.COLUMNS:
+            np.save(self.partition_path(league, season, column), rows[column][order])
+
+        entry = self.manifest.get(self.partition_key(league, season), {})
+        all_fingerprints = {**entry.get("fingerprints", {}), **fingerprints}
+        all_errors = sorted(
+            (set(entry.get("errors", [])) - set(fingerprints)) | {str(match_number) for match_number in errors}
+        )
+
+        self.manifest[self.partition_key(league, season)] = {
+            "league": league,
+            "season": season,
+            "matches": len(order),
+            "errors": all_errors,
+            "fingerprints": all_fingerprints,
+            "player data modified time": player_data_modified_time,
+        }
+
+        with open(self.manifest_path, "w") as json_file:
+            json.dump(self.manifest, json_file, indent=2)
+
+    def partitions(self, leagues=None, seasons=None):
+        return [
+            (entry["league"], entry["season"])
+            for _, entry in sorted(self.manifest.items())
+            if (leagues is None or entry["league"] in leagues)
+            and (seasons is None or entry["season"] in seasons)
+        ]
+
+    def read(self, leagues=None, seasons=None, columns=("feature-vectors", "targets")):
+        partitions = self.partitions(leagues, seasons)
+
+        assert partitions, "No feature vectors in the store for {} {}".format(leagues, seasons)
+
+        return tuple(
+            np.concatenate([np.load(self.partition_path(league, season, column)) for league, season in partitions])
+            for column in columns
+        )
+
+
+def shuffled_minibatches(rows, batch_size, gather, seed=None):
+    """Yield gather(batch rows) forever, reshuffling the rows at the start of every epoch."""
+    rng = np.random.default_rng(seed)
+    while True:
+        order = rng.permutation(rows)
+        for start in range(0, len(order), batch_size):
+            yield gather(order[start:start + batch_size])
+
+
+class TrainingDataset:
+    """Training rows of one or more store partitions, read through memory maps.
+
+    Nothing is loaded up front. Each batch gathers its rows from the memory-mapped files,
+    drops rows whose odds are missing, normalises the features and converts the odds to
+    implied probabilities, so memory use depends on the batch size rather than the data.
+    """
+
+    def __init__(self, feature_vectors, targets, rows=None):
+        self.feature_vectors = feature_vectors
+        self.targets = targets
+        self.offsets = np.cumsum([0] + [len(partition) for partition in feature_vectors])
+        self.rows = np.arange(self.offsets[-1]) if rows is None else rows
+
+    @classmethod
+    def from_store(cls, store, leagues=None, seasons=None):
+        partitions = store.partitions(leagues, seasons)
+
+        assert partitions, "No feature vectors in the store for {} {}".format(leagues, seasons)
+
+        feature_vectors = [
+            np.load(store.partition_path(league, season, "feature-vectors"), mmap_mode="r")
+            for league, season in partitions
+        ]
+        targets = [
+            np.load(store.partition_path(league, season, "targets"), mmap_mode="r")
+            for league, season in partitions
+        ]
+        return cls(feature_vectors, targets)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def split(self, validation_size):
+        """Split off the last validation_size rows as a validation dataset."""
+        return (
+            TrainingDataset(self.feature_vectors, self.targets, self.rows[:-validation_size]),
+            TrainingDataset(self.feature_vectors, self.targets, self.rows[-validation_size:]),
+        )
+
+    def batch(self, rows):
+        rows = np.sort(rows)
+        partitions = np.searchsorted(self.offsets, rows, side="right") - 1
+
+        feature_vectors = []
+        targets = []
+        for partition in np.unique(partitions):
+            local_rows = rows[partitions == partition] - self.offsets[partition]
+            feature_vectors.append(self.feature_vectors[partition][local_rows])
+            targets.append(self.targets[partition][local_rows])
+
+        feature_vectors = np.concatenate(feature_vectors)
+        targets = np.concatenate(targets)
+
+        valid = ~np.isnan(targets).any(axis=1)
+
+        return normalise_features(feature_vectors[valid]), 1 / targets[valid]
+
+    def arrays(self):
+        return self.batch(self.rows)
+
+    def minibatches(self, batch_size, seed=None):
+        return shuffled_minibatches(self.rows, batch_size, self.batch, seed=seed)
+
+
+def match_fingerprint(match):
+    return hashlib.sha1(json.dumps(match, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def build_match_features(match_data, player_data, player_index=None, cached=None, match_cache=None):
+    """Match both lineups of every match to FIFA players and build the store rows.
+
+    Returns (dict of FeatureStore.COLUMNS arrays, match numbers of the matches that could
+    not be built).
+    """
+    if player_index is None:
+        player_index = PlayerIndex(player_data)
+
+    cached_players = {} if cached is None else cached
+
+    feature_vectors = []
+    targets = []
+    match_numbers = []
+    dates = []
+    goals = []
+    errors = []
+
+    for match in match_data:
+
+        season = get_season(match)
+        home_lineup_names, away_lineup_names = get_lineup_names(match)
+        home_lineup_raw_names, away_lineup_raw_names = (
+            match["info"]["home lineup raw names"],
+            match["info"]["away lineup raw names"],
+        )
+        home_lineup_numbers, away_lineup_numbers = get_lineup_numbers(match)
+        home_lineup_nationalities, away_lineup_nationalities = get_lineup_nationalities(match)
+
+        try:
+            home_team, away_team = get_teams(match)
+            home_odds, draw_odds, away_odds = get_match_odds(match)
+
+            home_players_matched, cached_players = match_lineups_to_fifa_players(
+                home_lineup_names,
+                home_lineup_raw_names,
+                home_lineup_numbers,
+                home_lineup_nationalities,
+                home_team,
+                season,
+                player_data,
+                cached_players,
+                player_index=player_index,
+                match_cache=match_cache,
+            )
+            away_players_matched, cached_players = match_lineups_to_fifa_players(
+                away_lineup_names,
+                away_lineup_raw_names,
+                away_lineup_numbers,
+                away_lineup_nationalities,
+                away_team,
+                season,
+                player_data,
+                cached_players,
+                player_index=player_index,
+                match_cache=match_cache,
+            )
+
+            home_feature_vector = create_feature_vector_from_players(home_players_matched)
+            away_feature_vector = create_feature_vector_from_players(away_players_matched)
+
+            feature_vectors.append(home_feature_vector + away_feature_vector)
+            targets.append([home_odds, draw_odds, away_odds])
+            match_numbers.append(match["match number"])
+            dates.append(match["info"]["datetime"])
+            goals.append(get_goals(match))
+
+        except Exception as exception:
+            print(match["info"]["date"], match["info"]["home team"], match["info"]["away team"])
+            print(exception)
+            errors.append(match["match number"])
+
+    rows = {
+        "feature-vectors": np.array(feature_vectors, dtype=np.int64).reshape(-1, 36),
+        "targets": np.array(targets, dtype=np.float64).reshape(-1, 3),
+        "match-numbers": np.array(match_numbers, dtype=np.int64),
+        "dates": np.array(dates, dtype="datetime64[D]"),
+        "goals": np.array(goals, dtype=np.int64).reshape(-1, 2),
+    }
+
+    return rows, errors
+
+
+_worker_state = {}
+
+
+def _init_worker(match_cache_path):
+    player_data = read_player_data()
+    _worker_state["player data"] = player_data
+    _worker_state["player index"] = PlayerIndex(player_data)
+    _worker_state["match cache"] = (
+        PlayerMatchCache(match_cache_path) if match_cache_path is not None else None
+    )
+
+
+def _build_partition(arguments):
+    league, season, known_fingerprints = arguments
+
+    match_data = read_match_data(league=league, season=season)
+    match_data = assign_odds_to_match(match_data, read_all_football_data(league=league))
+
+    fingerprints = {str(match["match number"]): match_fingerprint(match) for match in match_data}
+    changed_matches = [
+        match
+        for match in match_data
+        if known_fingerprints.get(str(match["match number"])) != fingerprints[str(match["match number"])]
+    ]
+    fingerprints = {str(match["match number"]): fingerprints[str(match["match number"])] for match in changed_matches}
+
+    rows, errors = build_match_features(
+        changed_matches,
+        _worker_state["player data"],
+        player_index=_worker_state["player index"],
+        match_cache=_worker_state["match cache"],
+    )
+
+    return league, season, rows, fingerprints, errors
+
+
+def build_feature_store(leagues, seasons, directory=FEATURE_STORE_DIRECTORY, processes=None,
+                        match_cache_path=None):
+    """Build or update feature vectors and targets for every (league, season) over a process pool.
+
+    Each worker loads the player data once and keeps its own matching cache. Only matches
+    that are new or changed since the last build are matched, and the results are merged
+    into the FeatureStore by the parent as each partition finishes. The compiled player,
+    lineup and football-data caches are brought up to date by the parent first, so the
+    workers only ever read them.
+    """
+    player_data_modified_time = load_player_data_manifest()["source modified time"]
+    for league in leagues:
+        load_compiled_match_data(league)
+        ingest_football_data(league)
+
+    store = FeatureStore(directory)
+    partitions = [
+        (league, season, store.fingerprints(league, season, player_data_modified_time))
+        for league in leagues
+        for season in seasons
+    ]
+
+    with Pool(processes=processes, initializer=_init_worker, initargs=(match_cache_path,)) as pool:
+        for league, season, rows, fingerprints, errors in pool.imap_unordered(_build_partition, partitions):
+            if fingerprints:
+                store.update_partition(league, season, rows, fingerprints, errors, player_data_modified_time)
+            print("{} {}: {} new or changed matches, {} errors".format(
+                league, season, len(fingerprints), len(errors)))
+
+    return store
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--leagues",
+        type=str,
+        nargs="+",
+        required=True,
+        help="""\
+      The football-data league codes to build, e.g. E0 SP1.\
+      """
+    )
+    parser.add_argument(
+        "--seasons",
+        type=str,
+        nargs="+",
+        required=True,
+        help="""\
+      The seasons to build, e.g. 2013-2014 2014-2015.\
+      """
+    )
+    parser.add_argument(
+        "--directory",
+        type=str,
+        default=FEATURE_STORE_DIRECTORY,
+        help="""\
+      Where to write the feature store.\
+      """
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=None,
+        help="""\
+      Number of worker processes, defaults to the number of cores.\
+      """
+    )
+    parser.add_argument(
+        "--match-cache",
+        type=str,
+        default=None,
+        help="""\
+      Path of a persistent player match cache shared by the workers.\
+      """
+    )
+
+    arguments = parser.parse_args()
+
+    build_feature_store(
+        arguments.leagues,
+        arguments.seasons,
+        directory=arguments.directory,
+        processes=arguments.processes,
+        match_cache_path=arguments.match_cache,
+    )
@@ -0,0 +1,73 @@
+import functools
+import os
+
+import numpy as np
+
+LAYER_NAMES = ('hidden_layer', 'hidden_layer2', 'output')
+
+MAX_LOADED_WEIGHTS = 4
+
+
+class NumpyModel:
+    """Forward pass of the NeuralNet dense layers using weights exported to a .npz file."""
+
+    def __init__(self, path):
+        with np.load(path) as weights:
+            self.layers = [(weights[name + '_kernel'], weights[name + '_bias']) for name in LAYER_NAMES]
+
+    def predict(self, X):
+        activations = np.asarray(X, dtype=np.float32)
+
+        for kernel, bias in self.layers[:-1]:
+            activations = np.maximum(activations @ kernel + bias, 0)
+
+        kernel, bias = self.layers[-1]
+        logits = activations @ kernel + bias
+        logits -= logits.max(axis=1, keepdims=True)
+
+        exponentials = np.exp(logits)
+        return exponentials / exponentials.sum(axis=1, keepdims=True)
+
+
+class NumpyNeuralNet:
+    """Drop in replacement for NeuralNet.predict that never imports TensorFlow."""
+
+    @staticmethod
+    def predict(X, model_name):
+        return load_numpy_model(model_name).predict(X)
+
+
+def weights_path(model_name):
+    return model_name + '.npz'
+
+
+@functools.lru_cache(maxsize=MAX_LOADED_WEIGHTS)
+def _load_numpy_model(path, modified_time):
+    return NumpyModel(path)
+
+
+def load_numpy_model(model_name):
+    path = weights_path(model_name)
+    return _load_numpy_model(path, os.path.getmtime(path))
+
+
+def weights_are_current(model_name):
+    path = weights_path(model_name)
+    if not os.path.exists(path):
+        return False
+    checkpoint_index = model_name + '.index'
+    return not os.path.exists(checkpoint_index) or os.path.getmtime(path) >= os.path.getmtime(checkpoint_index)
+
+
+def load_predictor(model_name):
+    """Return an object with a predict(X) method for a checkpoint.
+
+    Exported NumPy weights are used when they exist and are at least as new as the checkpoint,
+    otherwise the TensorFlow checkpoint is restored, which is the only case where TensorFlow
+    is imported.
+    """
+    if weights_are_current(model_name):
+        return load_numpy_model(model_name)
+
+    from fifa_ratings_predictor.model import load_model
+    return load_model(model_name)
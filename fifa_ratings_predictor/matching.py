@@ -1,49 +1,213 @@
+from collections import defaultdict
+import sqlite3
+
 import fifa_ratings_predictor.constants as constants
 import numpy as np
-from fifa_ratings_predictor.data_methods import (
-    assign_odds_to_match,
-    get_goals,
-    get_lineup_names,
-    get_lineup_nationalities,
-    get_lineup_numbers,
-    get_match_odds,
-    get_season,
-    get_teams,
-    read_all_football_data,
-    read_match_data,
-    read_player_data,
-)
+from scipy import sparse
 
 
-def match_lineups_to_fifa_players(lineup_names, raw_names, lineup_numbers,
-                                  lineup_nationalities, team, season,
-                                  fifa_data, cached):
+class PlayerIndex:
+    """Columnar table of the FIFA players, used to score lineup slots in one vectorised pass.
+
+    Team, nationality and season are integer coded, kit numbers are an integer array and
+    name tokens are a sparse players x tokens matrix. Players are also indexed by
+    (season, team), (season, kit number) and name token, so only players sharing at least
+    one of those with a lineup are scored.
+    """
+
+    def __init__(self, fifa_data):
+        self.fifa_data = fifa_data
+        self.guids = np.array(list(fifa_data.keys()))
+
+        self.team_codes = {}
+        self.nationality_codes = {}
+        self.season_codes = {}
+        self.token_codes = {}
+
+        teams, nationalities, seasons, numbers = [], [], [], []
+        token_rows, token_columns = [], []
+
+        by_team = defaultdict(list)
+        by_number = defaultdict(list)
+        by_name_token = defaultdict(list)
+
+        for row, player in enumerate(fifa_data.values()):
+            teams.append(self.team_codes.setdefault(player["team"], len(self.team_codes)))
+            nationalities.append(
+                self.nationality_codes.setdefault(player["nationality"], len(self.nationality_codes))
+            )
+            seasons.append(self.season_codes.setdefault(player["season"], len(self.season_codes)))
+            numbers.append(int(player["number"]))
+
+            by_team[(player["season"], player["team"])].append(row)
+            by_number[(player["season"], int(player["number"]))].append(row)
+
+            for token in name_tokens(player["name"]):
+                token_rows.append(row)
+                token_columns.append(self.token_codes.setdefault(token, len(self.token_codes)))
+                by_name_token[token].append(row)
+
+        self.teams = np.array(teams)
+        self.nationalities = np.array(nationalities)
+        self.seasons = np.array(seasons)
+        self.numbers = np.array(numbers)
+
+        team_is_nationality = np.array([team in constants.NATIONALITIES for team in self.team_codes], dtype=bool)
+        self.team_is_nationality = team_is_nationality[self.teams]
 
-    all_fifa_players = [player["name"] for _, player in fifa_data.items()]
+        self.name_tokens = sparse.csr_matrix(
+            (np.ones(len(token_rows)), (token_rows, token_columns)),
+            shape=(len(self.guids), len(self.token_codes)),
+        )
+        self.name_token_counts = np.asarray(self.name_tokens.sum(axis=1)).ravel()
+
+        self.by_team = {key: np.array(rows) for key, rows in by_team.items()}
+        self.by_number = {key: np.array(rows) for key, rows in by_number.items()}
+        self.by_name_token = {key: np.array(rows) for key, rows in by_name_token.items()}
+
+    def candidate_rows(self, names, numbers, team, season):
+        """Sorted table rows of every player sharing a key with at least one lineup slot."""
+        rows = [self.by_team.get((season, team), [])]
+        for name, number in zip(names, numbers):
+            rows.append(self.by_number.get((season, int(number)), []))
+            rows.extend(self.by_name_token.get(token, []) for token in name_tokens(name))
+
+        rows = np.unique(np.concatenate(rows)).astype(int)
+
+        if not len(rows):
+            rows = np.arange(len(self.guids))
+
+        return rows
+
+    def probability_matrix(self, names, numbers, nationalities, team, season, rows):
+        """Slots x rows matrix of the same weighted match probability as assign_probability."""
+        slot_tokens = [name_tokens(name) for name in names]
+        slot_token_rows, slot_token_columns = [], []
+        for slot, tokens in enumerate(slot_tokens):
+            for token in tokens:
+                if token in self.token_codes:
+                    slot_token_rows.append(slot)
+                    slot_token_columns.append(self.token_codes[token])
+
+        slot_name_tokens = sparse.csr_matrix(
+            (np.ones(len(slot_token_rows)), (slot_token_rows, slot_token_columns)),
+            shape=(len(names), len(self.token_codes)),
+        )
+        shared_tokens = (slot_name_tokens @ self.name_tokens[rows].T).toarray()
+        smallest_lengths = np.minimum(
+            np.array([len(tokens) for tokens in slot_tokens])[:, None], self.name_token_counts[rows][None, :]
+        )
+        name_match = np.divide(
+            shared_tokens, smallest_lengths, out=np.zeros_like(shared_tokens), where=smallest_lengths > 0
+        )
+
+        team_match = np.where(
+            self.teams[rows] == self.team_codes.get(team, -1), 1.0, np.where(self.team_is_nationality[rows], 0.5, 0.0)
+        )
+        nationality_match = self.nationalities[rows][None, :] == np.array(
+            [self.nationality_codes.get(nationality, -1) for nationality in nationalities]
+        )[:, None]
+        number_match = self.numbers[rows][None, :] == np.array([int(number) for number in numbers])[:, None]
+        season_match = self.seasons[rows] == self.season_codes.get(season, -1)
+
+        return (
+            constants.NAME_PROBABILITY * name_match
+            + constants.TEAM_PROBABILITY * team_match
+            + constants.NATIONALITY_PROBABILITY * nationality_match
+            + constants.NUMBER_PROBABILITY * number_match
+            + constants.SEASON_PROBABILITY * season_match
+        )
+
+
+class PlayerMatchCache:
+    """Matched FIFA players persisted in SQLite, keyed by (raw name, team, season).
+
+    The player's name is stored alongside the guid, so a match is only reused while the
+    guid still refers to the same player in the loaded player data.
+    """
+
+    def __init__(self, path="./data/player-match-cache.sqlite", timeout=30):
+        self.connection = sqlite3.connect(path, timeout=timeout)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS player_matches ("
+            "raw_name TEXT, team TEXT, season TEXT, guid INTEGER, name TEXT, "
+            "PRIMARY KEY (raw_name, team, season))"
+        )
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, raw_name, team, season, fifa_data):
+        row = self.connection.execute(
+            "SELECT guid, name FROM player_matches WHERE raw_name = ? AND team = ? AND season = ?",
+            (raw_name, team, season),
+        ).fetchone()
+
+        if row is not None and row[0] in fifa_data and fifa_data[row[0]]["name"] == row[1]:
+            self.hits += 1
+            return row[0]
+
+        self.misses += 1
+        return None
+
+    def update(self, matches, team, season, fifa_data):
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO player_matches VALUES (?, ?, ?, ?, ?)",
+                [
+                    (raw_name, team, season, guid, fifa_data[guid]["name"])
+                    for raw_name, guid in matches.items()
+                ],
+            )
 
-    probability_dict = {raw_name: dict.fromkeys(all_fifa_players, 0)
-                        for raw_name in raw_names}
+    def close(self):
+        self.connection.close()
 
-    for lineup_name, raw_name, lineup_number, lineup_nationality in zip(
-        lineup_names, raw_names, lineup_numbers, lineup_nationalities
-    ):
 
-        try:
-            probability_dict[raw_name][cached[raw_name]] = 1.0
-        except KeyError:
+def match_lineups_to_fifa_players(lineup_names, raw_names, lineup_numbers,
+                                  lineup_nationalities, team, season,
+                                  fifa_data, cached, player_index=None,
+                                  match_cache=None):
+
+    if player_index is None:
+        player_index = PlayerIndex(fifa_data)
+
+    known = dict(cached)
+    if match_cache is not None:
+        for raw_name in raw_names:
+            if raw_name not in known:
+                guid = match_cache.get(raw_name, team, season, fifa_data)
+                if guid is not None:
+                    known[raw_name] = guid
+
+    uncached = [
+        slot for slot, raw_name in enumerate(raw_names) if raw_name not in known
+    ]
+
+    best_matches = {raw_name: (known.get(raw_name), 1.0) for raw_name in raw_names}
+
+    if uncached:
+        names = [lineup_names[slot] for slot in uncached]
+        numbers = [lineup_numbers[slot] for slot in uncached]
+        nationalities = [lineup_nationalities[slot] for slot in uncached]
+
+        rows = player_index.candidate_rows(names, numbers, team, season)
+        probability_matrix = player_index.probability_matrix(
+            names, numbers, nationalities, team, season, rows
+        )
+        best_columns = probability_matrix.argmax(axis=1)
 
-            for guid, player in fifa_data.items():
-                probability_dict[raw_name][guid] = assign_probability(
-                    player, lineup_name, lineup_number, lineup_nationality, team, season
-                )
+        for slot, column, probability in zip(
+            uncached, best_columns, probability_matrix[np.arange(len(uncached)), best_columns]
+        ):
+            best_matches[raw_names[slot]] = (player_index.guids[rows[column]].item(), probability)
 
-    max_prob_dict = {max(v, key=v.get): k for k, v in probability_dict.items()}
+    max_prob_dict = {guid: raw_name for raw_name, (guid, _) in best_matches.items()}
     players_to_cache = {v: k for k, v in max_prob_dict.items()}
 
     msg = "We need 11 players, retrieved {}".format(len(max_prob_dict.keys()))
     assert len(max_prob_dict.keys()) == 11, msg
 
-    probabilities = [probability_dict[v][k] for k, v in max_prob_dict.items()]
+    probabilities = [best_matches[v][1] for k, v in max_prob_dict.items()]
 
     if any(probabilities) < 0.5:
         print("Warning, lowest probability is {}".format(min(probabilities)))
@@ -51,6 +215,14 @@ def match_lineups_to_fifa_players(lineup_names, raw_names, lineup_numbers,
 
     x = [fifa_data[guid] for guid, _ in max_prob_dict.items()]
 
+    if match_cache is not None:
+        match_cache.update(
+            {raw_names[slot]: best_matches[raw_names[slot]][0] for slot in uncached},
+            team,
+            season,
+            fifa_data,
+        )
+
     cached = {**cached, **players_to_cache}
 
     return x, cached
@@ -98,13 +270,17 @@ def fuzzy_team_match(match_team, player_team):
 
 
 def match_name(name1, name2):
-    name1 = set(remove_length_one_strings(name1.split("-")))
-    name2 = set(remove_length_one_strings(name2.split("-")))
+    name1 = name_tokens(name1)
+    name2 = name_tokens(name2)
     smallest_length = min(len(name1), len(name2))
 
     return len(name1.intersection(name2)) / smallest_length
 
 
+def name_tokens(name):
+    return set(remove_length_one_strings(name.split("-")))
+
+
 def remove_length_one_strings(li):
     return [x for x in li if len(x) > 1]
 
@@ -146,84 +322,3 @@ def create_feature_vector_from_players(players):
 
     return goalkeeper + defence + midfield + attack
 
-
-if __name__ == "__main__":
-    errors = []
-
-    data = read_player_data()
-
-    match_data = read_match_data(league="SP1", season="2013-2014")
-
-    football_data = read_all_football_data(league="SP1")
-
-    match_data = assign_odds_to_match(match_data, football_data)
-
-    feature_vectors = []
-    targets = []
-
-    cached_players = {}
-
-    for i, test_match in enumerate(reversed(match_data)):
-
-        season = get_season(test_match)
-        home_team, away_team = get_teams(test_match)
-        home_goals, away_goals = get_goals(test_match)
-        home_lineup_names, away_lineup_names = get_lineup_names(test_match)
-        home_lineup_raw_names, away_lineup_raw_names = (
-            test_match["info"]["home lineup raw names"],
-            test_match["info"]["away lineup raw names"],
-        )
-        home_lineup_numbers, away_lineup_numbers = get_lineup_numbers(test_match)
-        home_lineup_nationalities, away_lineup_nationalities = get_lineup_nationalities(
-            test_match
-        )
-        home_odds, draw_odds, away_odds = get_match_odds(test_match)
-
-        print(i, season, "{} vs. {}".format(home_team, away_team))
-
-        if len(home_lineup_names) != 11:
-            print("error")
-
-        try:
-            home_players_matched, cached_players = match_lineups_to_fifa_players(
-                home_lineup_names,
-                home_lineup_raw_names,
-                home_lineup_numbers,
-                home_lineup_nationalities,
-                home_team,
-                season,
-                data,
-                cached_players,
-            )
-            away_players_matched, cached_players = match_lineups_to_fifa_players(
-                away_lineup_names,
-                away_lineup_raw_names,
-                away_lineup_numbers,
-                away_lineup_nationalities,
-                away_team,
-                season,
-                data,
-                cached_players,
-            )
-
-            home_feature_vector = create_feature_vector_from_players(
-                home_players_matched
-            )
-            away_feature_vector = create_feature_vector_from_players(
-                away_players_matched
-            )
-
-            feature_vectors.append(home_feature_vector + away_feature_vector)
-            targets.append([home_odds, draw_odds, away_odds])
-
-        except Exception as exception:
-            print("There is an issues with the above match")
-            print(exception)
-            test_match["error"] = exception
-            errors.append(test_match)
-
-    feature_vectors = np.array(feature_vectors)
-    targets = np.array(targets)
-
-    np.save("feature-vectors-13-14.npy", feature_vectors)
-    np.save("targets-13-14.npy", targets)
@@ -1,7 +1,20 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+
 import numpy as np
 import tensorflow as tf
 
-from fifa_ratings_predictor.data_methods import normalise_features
+from fifa_ratings_predictor.features import FeatureStore, TrainingDataset, shuffled_minibatches
+from fifa_ratings_predictor.inference import LAYER_NAMES, load_numpy_model, weights_path
+
+MAX_LOADED_MODELS = 4
+PARITY_SAMPLES = 8
+PARITY_TOLERANCE = 1e-5
+
+_loaded_models = OrderedDict()
+_loaded_models_lock = threading.Lock()
 
 
 class NeuralNet:
@@ -47,47 +60,172 @@ class NeuralNet:
         saver = tf.train.Saver(max_to_keep=1)
         return writer, saver
 
-    def train_model(self, X, y, X_val, y_val, model_name):
+    @staticmethod
+    def minibatches(X, y, batch_size, seed=None):
+        return shuffled_minibatches(np.arange(len(X)), batch_size, lambda rows: (X[rows], y[rows]), seed=seed)
+
+    @staticmethod
+    def prefetch(batches):
+        """Prepare the next batch on a background thread while the current one is trained on."""
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            next_batch = executor.submit(next, batches)
+            while True:
+                try:
+                    batch = next_batch.result()
+                except StopIteration:
+                    return
+                next_batch = executor.submit(next, batches)
+                yield batch
+
+    def train_model(self, X, y, X_val, y_val, model_name, batch_size=128, max_iterations=40000,
+                    validation_interval=1000, patience=5, seed=None, batches=None):
+        """Train on shuffled minibatches, saving the checkpoint whenever the validation loss improves.
+
+        Minibatches are drawn from X and y unless another (X, y) batch generator is given,
+        and training also ends if that generator runs out. A checkpoint is only saved once the validation loss is below 0.05. Training stops after
+        max_iterations, or once the validation loss has not improved on the lowest seen so far
+        for patience consecutive validation checks. Returns the best saved validation loss.
+        """
 
         best_val_loss = 0.05
+        lowest_val_loss = np.inf
+        checks_without_improvement = 0
+
+        if batches is None:
+            batches = self.minibatches(X, y, batch_size, seed=seed)
+
+        batches = self.prefetch(batches)
+
+        try:
+            with tf.Session(graph=self.graph) as sess:
+
+                writer, saver = self.init_saver(sess)
 
-        with tf.Session(graph=self.graph) as sess:
+                sess.run(tf.global_variables_initializer())
 
-            writer, saver = self.init_saver(sess)
+                for i, (X_batch, y_batch) in zip(range(max_iterations), batches):
 
-            sess.run(tf.global_variables_initializer())
+                    feed_dict = {self.input: X_batch, self.target: y_batch, self.keep_prob: 0.8}
 
-            for i in range(40000):
+                    _, current_loss, train_sum = sess.run([self.train, self.loss, self.training_summary],
+                                                          feed_dict=feed_dict)
 
-                feed_dict = {self.input: X, self.target: y, self.keep_prob: 0.8}
+                    if i % validation_interval == 0:
+                        val_loss, val_sum = sess.run([self.loss, self.validation_summary],
+                                                     feed_dict={self.input: X_val, self.target: y_val,
+                                                                self.keep_prob: 1.0})
+                        writer.add_summary(val_sum, i)
+                        writer.add_summary(train_sum, i)
 
-                _, current_loss, train_sum = sess.run([self.train, self.loss, self.training_summary],
-                                                      feed_dict=feed_dict)
+                        print(i, current_loss, val_loss)
+                        if val_loss < best_val_loss:
+                            best_val_loss = val_loss
+                            saver.save(sess, model_name)
+                            unload_model(model_name)
 
-                if i % 1000 == 0:
-                    val_loss, val_sum = sess.run([self.loss, self.validation_summary],
-                                                 feed_dict={self.input: X_val, self.target: y_val, self.keep_prob: 1.0})
-                    writer.add_summary(val_sum, i)
-                    writer.add_summary(train_sum, i)
+                        if val_loss < lowest_val_loss:
+                            lowest_val_loss = val_loss
+                            checks_without_improvement = 0
+                        else:
+                            checks_without_improvement += 1
+                            if checks_without_improvement >= patience:
+                                print('Stopping early at iteration {}'.format(i))
+                                break
+        finally:
+            batches.close()
 
-                    print(i, current_loss, val_loss)
-                    if val_loss < best_val_loss:
-                        best_val_loss = val_loss
-                        saver.save(sess, model_name)
+        return best_val_loss
+
+    def train_on_dataset(self, dataset, validation_dataset, model_name, batch_size=128, seed=None, **kwargs):
+        """Train on minibatches streamed from a TrainingDataset rather than arrays in memory."""
+        X_val, y_val = validation_dataset.arrays()
+        return self.train_model(None, None, X_val, y_val, model_name,
+                                batches=dataset.minibatches(batch_size, seed=seed), **kwargs)
 
     def predict(self, X, model_name):
+        return load_model(model_name).predict(X)
+
+
+class LoadedModel:
+    """A checkpoint restored into its own graph and session, ready for repeated predictions."""
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self.graph = tf.Graph()
 
-        with tf.Session() as sess:
+        with self.graph.as_default():
             saver = tf.train.import_meta_graph(model_name + '.meta')
-            saver.restore(sess, model_name)
-            graph = tf.get_default_graph()
-            input = graph.get_tensor_by_name('input:0')
-            keep_prob = graph.get_tensor_by_name('keep_prob:0')
-            output = graph.get_tensor_by_name('softmax:0')
-            feed_dict = {input: X, keep_prob: 1.0}
-            predictions = sess.run(output, feed_dict=feed_dict)
+            self.session = tf.Session(graph=self.graph)
+            saver.restore(self.session, model_name)
+
+        self.input = self.graph.get_tensor_by_name('input:0')
+        self.keep_prob = self.graph.get_tensor_by_name('keep_prob:0')
+        self.output = self.graph.get_tensor_by_name('softmax:0')
+
+    def predict(self, X):
+        return self.session.run(self.output, feed_dict={self.input: X, self.keep_prob: 1.0})
+
+    def close(self):
+        self.session.close()
 
-        return predictions
+
+def load_model(model_name):
+    """Return the LoadedModel for a checkpoint, restoring it only if it is not already loaded.
+
+    The most recently used MAX_LOADED_MODELS checkpoints are kept, and the least recently
+    used session is closed when another one is loaded.
+    """
+    with _loaded_models_lock:
+        try:
+            model = _loaded_models.pop(model_name)
+        except KeyError:
+            model = LoadedModel(model_name)
+        _loaded_models[model_name] = model
+
+        while len(_loaded_models) > MAX_LOADED_MODELS:
+            _, evicted_model = _loaded_models.popitem(last=False)
+            evicted_model.close()
+
+    return model
+
+
+def export_weights(model_name, parity_inputs=None):
+    """Write a checkpoint's dense layer weights to a .npz file for the NumPy predictor.
+
+    The NumPy predictions are checked against the TensorFlow predictions before returning,
+    for parity_inputs if given and otherwise for a fixed set of random inputs. If they differ
+    the .npz file is removed so the checkpoint stays in use, and a ValueError is raised.
+    """
+    reader = tf.train.NewCheckpointReader(model_name)
+
+    weights = {}
+    for layer_name in LAYER_NAMES:
+        weights[layer_name + '_kernel'] = reader.get_tensor(layer_name + '/kernel')
+        weights[layer_name + '_bias'] = reader.get_tensor(layer_name + '/bias')
+
+    path = weights_path(model_name)
+    np.savez(path, **weights)
+
+    if parity_inputs is None:
+        input_size = weights[LAYER_NAMES[0] + '_kernel'].shape[0]
+        parity_inputs = np.random.RandomState(0).uniform(size=(PARITY_SAMPLES, input_size))
+
+    numpy_predictions = load_numpy_model(model_name).predict(parity_inputs)
+    tensorflow_predictions = load_model(model_name).predict(parity_inputs)
+    difference = np.max(np.abs(np.asarray(numpy_predictions) - np.asarray(tensorflow_predictions)))
+    if not difference <= PARITY_TOLERANCE:
+        os.remove(path)
+        raise ValueError('NumPy predictions differ from TensorFlow for {} by up to {:.3g}'.format(model_name,
+                                                                                                  difference))
+
+    return path
+
+
+def unload_model(model_name):
+    with _loaded_models_lock:
+        model = _loaded_models.pop(model_name, None)
+    if model is not None:
+        model.close()
 
 
 if __name__ == '__main__':
@@ -97,32 +235,21 @@ if __name__ == '__main__':
 
     league = 'F1'
 
-    inputs = np.vstack((np.load('./data/lineup-data/' + league + '/processed-numpy-arrays/feature-vectors-13-14.npy'),
-                        np.load('./data/lineup-data/' + league + '/processed-numpy-arrays/feature-vectors-14-15.npy'),
-                        np.load('./data/lineup-data/' + league + '/processed-numpy-arrays/feature-vectors-15-16.npy'),
-                        np.load('./data/lineup-data/' + league + '/processed-numpy-arrays/feature-vectors-16-17.npy')))
-    inputs = normalise_features(inputs)
-    outputs = np.vstack((np.load('./data/lineup-data/' + league + '/processed-numpy-arrays/targets-13-14.npy'),
-                        np.load('./data/lineup-data/' + league + '/processed-numpy-arrays/targets-14-15.npy'),
-                        np.load('./data/lineup-data/' + league + '/processed-numpy-arrays/targets-15-16.npy'),
-                        np.load('./data/lineup-data/' + league + '/processed-numpy-arrays/targets-16-17.npy'))).reshape(-1, 3)
+    dataset = TrainingDataset.from_store(FeatureStore(), leagues=[league],
+                                         seasons=['2013-2014', '2014-2015', '2015-2016', '2016-2017'])
 
-    nan_rows = np.where(outputs != outputs)[0]
-
-    inputs = np.delete(inputs, nan_rows, axis=0)
-    outputs = np.delete(outputs, nan_rows, axis=0)
-
-    outputs = 1 / outputs
+    training_data, validation_data = dataset.split(10)
 
     net = NeuralNet()
 
-    net.train_model(inputs[:-10], outputs[:-10], inputs[-10:], outputs[-10:], model_name='./models/' + league +
-                                                                                    '/deep')
+    net.train_on_dataset(training_data, validation_data, model_name='./models/' + league + '/deep')
 
-    net = NeuralNet()
+    inputs, outputs = dataset.split(50)[1].arrays()
+
+    export_weights('./models/' + league + '/deep', parity_inputs=inputs)
 
-    predictions = net.predict(inputs[-50:], model_name='./models/' + league + '/deep')
+    predictions = load_model('./models/' + league + '/deep').predict(inputs)
 
-    for i, j in zip(predictions, outputs[-50:]):
+    for i, j in zip(predictions, outputs):
         print(i)
         print(j)
@@ -0,0 +1,305 @@
+from collections import OrderedDict
+from multiprocessing import Pool
+
+import numpy as np
+
+HOME_WIN = 0
+DRAW = 1
+AWAY_WIN = 2
+
+HOME_POINTS = np.array([3, 1, 0], dtype=np.int16)
+AWAY_POINTS = np.array([0, 1, 3], dtype=np.int16)
+
+# Zones are (first, last) final positions, counted from 1 at the top or from -1 at the bottom.
+DEFAULT_ZONES = OrderedDict([('1st Place', (1, 1)), ('Top 4', (1, 4)), ('Relegation', (-3, -1))])
+
+MAX_GOALS = 15
+# Goal rates are kept where a MAX_GOALS truncation of the Poisson distribution is accurate.
+MIN_GOAL_RATE = 0.05
+MAX_GOAL_RATE = 6.0
+
+
+class SeasonTally:
+    """Running totals over many simulated seasons, one entry per team index."""
+
+    def __init__(self, number_of_teams):
+        self.number_of_teams = number_of_teams
+        self.number_of_simulations = 0
+
+        self.total_points = np.zeros(number_of_teams, dtype=np.int64)
+        self.wins = np.zeros(number_of_teams, dtype=np.int64)
+        self.draws = np.zeros(number_of_teams, dtype=np.int64)
+        self.losses = np.zeros(number_of_teams, dtype=np.int64)
+        self.goals_for = np.zeros(number_of_teams, dtype=np.int64)
+        self.goals_against = np.zeros(number_of_teams, dtype=np.int64)
+        self.positions = np.zeros((number_of_teams, number_of_teams), dtype=np.int64)
+
+    def merge(self, other):
+        """Add another tally of the same teams, e.g. from a different worker, to this one."""
+        assert self.number_of_teams == other.number_of_teams, "Can only merge tallies of the same teams"
+
+        self.number_of_simulations += other.number_of_simulations
+        self.total_points += other.total_points
+        self.wins += other.wins
+        self.draws += other.draws
+        self.losses += other.losses
+        self.goals_for += other.goals_for
+        self.goals_against += other.goals_against
+        self.positions += other.positions
+
+        return self
+
+    def zone_counts(self, zone):
+        """Number of seasons each team finished within a (first, last) zone of final positions."""
+        return self.positions[:, zone_slice(zone, self.number_of_teams)].sum(axis=1)
+
+
+def zone_slice(zone, number_of_teams):
+    first, last = zone
+    start = first - 1 if first > 0 else number_of_teams + first
+    stop = last if last > 0 else number_of_teams + last + 1
+
+    assert 0 <= start < stop <= number_of_teams, "Zone {} is outside {} positions".format(zone, number_of_teams)
+
+    return slice(start, stop)
+
+
+def sample_results(match_probabilities, number_of_simulations, seed=None, chunk_size=20000):
+    """Draw a fixtures x simulations int8 matrix of result codes from 1X2 probabilities."""
+    rng = np.random.default_rng(seed)
+
+    match_probabilities = np.asarray(match_probabilities, dtype=np.float64).reshape(-1, 3)
+    cumulative_probabilities = np.cumsum(match_probabilities, axis=1)
+    cumulative_probabilities /= cumulative_probabilities[:, -1:]
+
+    home_win_threshold = cumulative_probabilities[:, 0:1]
+    draw_threshold = cumulative_probabilities[:, 1:2]
+
+    result_codes = np.empty((len(match_probabilities), number_of_simulations), dtype=np.int8)
+
+    for start in range(0, number_of_simulations, chunk_size):
+        stop = min(start + chunk_size, number_of_simulations)
+        uniforms = rng.random((len(match_probabilities), stop - start))
+        result_codes[:, start:stop] = (uniforms >= home_win_threshold).astype(np.int8) + (uniforms >= draw_threshold)
+
+    return result_codes
+
+
+def poisson_probabilities(goal_rates, max_goals=MAX_GOALS):
+    """Probabilities of 0 to max_goals goals for every rate, in a trailing goals axis."""
+    goals = np.arange(max_goals + 1)
+    log_factorials = np.cumsum(np.log(np.maximum(goals, 1)))
+    goal_rates = np.asarray(goal_rates, dtype=np.float64)[..., None]
+    return np.exp(goals * np.log(goal_rates) - goal_rates - log_factorials)
+
+
+def scoreline_probabilities(goal_rates, max_goals=10):
+    """Fixtures x home goals x away goals probabilities of each exact score for independent Poisson rates."""
+    goal_probabilities = poisson_probabilities(goal_rates, max_goals=max_goals)
+    return goal_probabilities[:, 0, :, None] * goal_probabilities[:, 1, None, :]
+
+
+def calibrate_goal_rates(match_probabilities, max_iterations=50, tolerance=1e-10, max_goals=MAX_GOALS):
+    """Fit Poisson home and away goal rates that reproduce each fixture's 1X2 probabilities."""
+    match_probabilities = np.asarray(match_probabilities, dtype=np.float64).reshape(-1, 3)
+    match_probabilities = match_probabilities / match_probabilities.sum(axis=1, keepdims=True)
+
+    goals = np.arange(max_goals + 1)
+    home_win = goals[:, None] > goals[None, :]
+    draw = goals[:, None] == goals[None, :]
+    away_win = goals[:, None] < goals[None, :]
+    outcomes = np.stack([home_win, draw, away_win]).astype(np.float64)
+
+    log_rates = np.tile(np.log([1.5, 1.1]), (len(match_probabilities), 1))
+
+    for _ in range(max_iterations):
+        goal_rates = np.exp(log_rates)
+        goal_probabilities = poisson_probabilities(goal_rates, max_goals=max_goals)
+        home_probabilities, away_probabilities = goal_probabilities[:, 0], goal_probabilities[:, 1]
+        home_derivatives = home_probabilities * (goals - goal_rates[:, 0:1])
+        away_derivatives = away_probabilities * (goals - goal_rates[:, 1:2])
+
+        fitted = np.einsum('nh,oha,na->no', home_probabilities, outcomes, away_probabilities)
+        jacobian = np.stack([np.einsum('nh,oha,na->no', home_derivatives, outcomes, away_probabilities),
+                             np.einsum('nh,oha,na->no', home_probabilities, outcomes, away_derivatives)], axis=2)
+        residuals = fitted - match_probabilities
+
+        normal_matrix = np.einsum('noi,noj->nij', jacobian, jacobian) + 1e-9 * np.eye(2)
+        gradient = np.einsum('noi,no->ni', jacobian, residuals)
+        steps = -np.linalg.solve(normal_matrix, gradient[:, :, None])[:, :, 0]
+        log_rates = np.clip(log_rates + np.clip(steps, -1, 1), np.log(MIN_GOAL_RATE), np.log(MAX_GOAL_RATE))
+
+        if np.abs(steps).max(initial=0) < tolerance:
+            break
+
+    return np.exp(log_rates)
+
+
+def sample_scorelines(goal_rates, number_of_simulations, seed=None):
+    """Draw fixtures x simulations int16 matrices of home and away goals from Poisson goal rates."""
+    rng = np.random.default_rng(seed)
+    goal_rates = np.asarray(goal_rates, dtype=np.float64).reshape(-1, 2)
+    size = (len(goal_rates), number_of_simulations)
+    home_goals = rng.poisson(goal_rates[:, 0:1], size=size).astype(np.int16)
+    away_goals = rng.poisson(goal_rates[:, 1:2], size=size).astype(np.int16)
+    return home_goals, away_goals
+
+
+def results_from_scorelines(home_goals, away_goals):
+    return (home_goals <= away_goals).astype(np.int8) + (home_goals < away_goals)
+
+
+def scatter_add(team_indices, values, number_of_teams):
+    """Sum a fixtures x simulations matrix into a teams x simulations matrix by team index."""
+    totals = np.zeros((number_of_teams, values.shape[1]), dtype=np.int32)
+    for team_index, fixture_values in zip(team_indices, values):
+        totals[team_index] += fixture_values
+    return totals
+
+
+def league_points(result_codes, home_indices, away_indices, number_of_teams):
+    return (scatter_add(home_indices, HOME_POINTS[result_codes], number_of_teams) +
+            scatter_add(away_indices, AWAY_POINTS[result_codes], number_of_teams))
+
+
+def rank_teams(points, rng, goal_difference=None):
+    """Positions x simulations matrix of the team index finishing in each position.
+
+    Ties on points and goal difference are broken at random.
+    """
+    tie_breaks = rng.random(points.shape)
+    if goal_difference is None:
+        return np.lexsort((tie_breaks, -points), axis=0)
+    return np.lexsort((tie_breaks, -goal_difference, -points), axis=0)
+
+
+def count_positions(league_positions, number_of_teams):
+    """Teams x positions counts of a positions x simulations matrix of team indices."""
+    position_indices = np.arange(number_of_teams)[:, None]
+    counts = np.bincount((league_positions * number_of_teams + position_indices).ravel(),
+                         minlength=number_of_teams * number_of_teams)
+    return counts.reshape(number_of_teams, number_of_teams)
+
+
+def tally_results(tally, result_codes, home_indices, away_indices, chunk_size=20000, seed=None,
+                  home_goals=None, away_goals=None, base=None):
+    """Add a fixtures x simulations matrix of result codes to a SeasonTally."""
+    rng = np.random.default_rng(seed)
+    number_of_teams = tally.number_of_teams
+    number_of_simulations = result_codes.shape[1]
+
+    if base is not None:
+        tally.wins += base.wins * number_of_simulations
+        tally.draws += base.draws * number_of_simulations
+        tally.losses += base.losses * number_of_simulations
+        tally.goals_for += base.goals_for * number_of_simulations
+        tally.goals_against += base.goals_against * number_of_simulations
+
+    home_wins = (result_codes == HOME_WIN).sum(axis=1)
+    draws = (result_codes == DRAW).sum(axis=1)
+    away_wins = (result_codes == AWAY_WIN).sum(axis=1)
+
+    tally.wins += np.bincount(home_indices, weights=home_wins, minlength=number_of_teams).astype(np.int64)
+    tally.wins += np.bincount(away_indices, weights=away_wins, minlength=number_of_teams).astype(np.int64)
+    tally.losses += np.bincount(home_indices, weights=away_wins, minlength=number_of_teams).astype(np.int64)
+    tally.losses += np.bincount(away_indices, weights=home_wins, minlength=number_of_teams).astype(np.int64)
+    tally.draws += np.bincount(home_indices, weights=draws, minlength=number_of_teams).astype(np.int64)
+    tally.draws += np.bincount(away_indices, weights=draws, minlength=number_of_teams).astype(np.int64)
+
+    if home_goals is not None:
+        home_goal_totals = home_goals.sum(axis=1)
+        away_goal_totals = away_goals.sum(axis=1)
+        tally.goals_for += np.bincount(home_indices, weights=home_goal_totals, minlength=number_of_teams).astype(
+            np.int64)
+        tally.goals_for += np.bincount(away_indices, weights=away_goal_totals, minlength=number_of_teams).astype(
+            np.int64)
+        tally.goals_against += np.bincount(home_indices, weights=away_goal_totals, minlength=number_of_teams).astype(
+            np.int64)
+        tally.goals_against += np.bincount(away_indices, weights=home_goal_totals, minlength=number_of_teams).astype(
+            np.int64)
+
+    for start in range(0, number_of_simulations, chunk_size):
+        chunk = result_codes[:, start:start + chunk_size]
+
+        points = league_points(chunk, home_indices, away_indices, number_of_teams)
+        if base is not None:
+            points += base.total_points[:, None].astype(points.dtype)
+        tally.total_points += points.sum(axis=1)
+
+        goal_difference = None
+        if home_goals is not None:
+            margins = home_goals[:, start:start + chunk_size] - away_goals[:, start:start + chunk_size]
+            goal_difference = (scatter_add(home_indices, margins, number_of_teams) -
+                               scatter_add(away_indices, margins, number_of_teams))
+            if base is not None:
+                goal_difference += (base.goals_for - base.goals_against)[:, None].astype(goal_difference.dtype)
+
+        league_positions = rank_teams(points, rng, goal_difference=goal_difference)
+        tally.positions += count_positions(league_positions, number_of_teams)
+
+    tally.number_of_simulations += number_of_simulations
+
+    return tally
+
+
+def played_standings(home_indices, away_indices, home_goals, away_goals, number_of_teams):
+    """SeasonTally of the matches already played, to be used as the base of every simulated season."""
+    home_goals = np.asarray(home_goals, dtype=np.int16).reshape(-1, 1)
+    away_goals = np.asarray(away_goals, dtype=np.int16).reshape(-1, 1)
+
+    standings = SeasonTally(number_of_teams)
+    tally_results(standings, results_from_scorelines(home_goals, away_goals), np.asarray(home_indices, dtype=int),
+                  np.asarray(away_indices, dtype=int), home_goals=home_goals, away_goals=away_goals)
+
+    standings.positions[:] = 0
+    standings.number_of_simulations = 0
+
+    return standings
+
+
+def simulate_shard(arguments):
+    """Sample and tally one shard of simulations, a chunk at a time, from its own seed."""
+    (match_probabilities, number_of_simulations, seed, home_indices, away_indices, number_of_teams, chunk_size,
+     goal_rates, base) = arguments
+
+    rng = np.random.default_rng(seed)
+    tally = SeasonTally(number_of_teams)
+
+    for start in range(0, number_of_simulations, chunk_size):
+        chunk_simulations = min(chunk_size, number_of_simulations - start)
+        if goal_rates is None:
+            result_codes = sample_results(match_probabilities, chunk_simulations, seed=rng, chunk_size=chunk_size)
+            tally_results(tally, result_codes, home_indices, away_indices, chunk_size=chunk_size, seed=rng,
+                          base=base)
+        else:
+            home_goals, away_goals = sample_scorelines(goal_rates, chunk_simulations, seed=rng)
+            tally_results(tally, results_from_scorelines(home_goals, away_goals), home_indices, away_indices,
+                          chunk_size=chunk_size, seed=rng, home_goals=home_goals, away_goals=away_goals, base=base)
+
+    return tally
+
+
+def simulate_seasons(match_probabilities, number_of_simulations, home_indices, away_indices, number_of_teams,
+                     seed=None, processes=1, chunk_size=20000, goal_rates=None, base=None):
+    """Simulate seasons split into one shard per process and merge the shard tallies."""
+    if isinstance(seed, np.random.Generator):
+        seed_sequences = np.random.SeedSequence(seed.integers(2 ** 63, size=4)).spawn(processes)
+    else:
+        seed_sequences = np.random.SeedSequence(seed).spawn(processes)
+    shard_sizes = [len(x) for x in np.array_split(np.arange(number_of_simulations), processes)]
+
+    shards = [(match_probabilities, shard_size, seed_sequence, home_indices, away_indices, number_of_teams,
+               chunk_size, goal_rates, base)
+              for shard_size, seed_sequence in zip(shard_sizes, seed_sequences)]
+
+    if processes == 1:
+        tallies = [simulate_shard(shards[0])]
+    else:
+        with Pool(processes=processes) as pool:
+            tallies = pool.map(simulate_shard, shards)
+
+    tally = SeasonTally(number_of_teams)
+    for shard_tally in tallies:
+        tally.merge(shard_tally)
+
+    return tally
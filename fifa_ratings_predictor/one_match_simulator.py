@@ -1,42 +1,95 @@
 import argparse
+import csv
+import json
 
 import numpy as np
 
-from fifa_ratings_predictor.model import NeuralNet
 from fifa_ratings_predictor.data_methods import normalise_features
+from fifa_ratings_predictor.inference import load_predictor
 
 
-def one_match_simulator(home_goalkeeper, home_defenders, home_midfielders, home_forwards, away_goalkeeper,
-                        away_defenders, away_midfielders, away_forwards,
-                        model_name='/Users/bgrantham/Documents/Personal/fifa-ratings-predictor/fifa_ratings_predictor'
-                                   '/deep-models'
-                                   '-all/deep'):
-    home_defenders = home_defenders + [0] * (6 - len(home_defenders))
-    away_defenders = away_defenders + [0] * (6 - len(away_defenders))
-    home_midfielders = home_midfielders + [0] * (7 - len(home_midfielders))
-    away_midfielders = away_midfielders + [0] * (7 - len(away_midfielders))
-    home_forwards = home_forwards + [0] * (4 - len(home_forwards))
-    away_forwards = away_forwards + [0] * (4 - len(away_forwards))
+DEFAULT_MODEL_NAME = '/Users/bgrantham/Documents/Personal/fifa-ratings-predictor/fifa_ratings_predictor' \
+                     '/deep-models-all/deep'
+
+POSITION_WIDTHS = (('goalkeeper', 1), ('defenders', 6), ('midfielders', 7), ('forwards', 4))
 
-    home_feature_vector = home_goalkeeper + home_defenders + home_midfielders + home_forwards
-    away_feature_vector = away_goalkeeper + away_defenders + away_midfielders + away_forwards
 
-    feature_vector = normalise_features(np.array(home_feature_vector + away_feature_vector)).reshape(1, 36)
+def one_match_simulator(home_goalkeeper, home_defenders, home_midfielders, home_forwards, away_goalkeeper,
+                        away_defenders, away_midfielders, away_forwards, model_name=DEFAULT_MODEL_NAME):
+    lineup = {'home_goalkeeper': home_goalkeeper, 'home_defenders': home_defenders,
+              'home_midfielders': home_midfielders, 'home_forwards': home_forwards,
+              'away_goalkeeper': away_goalkeeper, 'away_defenders': away_defenders,
+              'away_midfielders': away_midfielders, 'away_forwards': away_forwards}
+
+    feature_vector = normalise_features(pad_lineups([lineup]))
 
-    net = NeuralNet()
-    probability = net.predict(feature_vector, model_name)
+    probability = load_predictor(model_name).predict(feature_vector)
 
     return probability[0]
 
 
+def pad_lineups(lineups):
+    """Pad lineups into an (N, 36) matrix of ratings, zero filling the unused position slots.
+
+    Each lineup is a dict with the same keys as the one_match_simulator arguments, e.g.
+    'home_defenders', holding a list of ratings.
+    """
+    assert isinstance(lineups, list) and all(isinstance(lineup, dict) for lineup in lineups), \
+        'Lineups must be a list of dicts'
+
+    blocks = []
+    for side in ('home', 'away'):
+        for position, width in POSITION_WIDTHS:
+            ratings = [lineup.get(side + '_' + position) or [] for lineup in lineups]
+            lengths = np.array([len(x) for x in ratings])
+
+            assert (lengths <= width).all(), 'No more than {} {} {} allowed'.format(width, side, position)
+
+            block = np.zeros((len(lineups), width))
+            block[np.arange(width) < lengths[:, None]] = np.concatenate([np.zeros(0)] + ratings)
+            blocks.append(block)
+
+    return np.hstack(blocks)
+
+
+def read_lineups(filepath):
+    """Read lineups from a json list of dicts, or a csv with space separated ratings per column."""
+    if filepath.endswith('.json'):
+        with open(filepath) as jsonfile:
+            return json.load(jsonfile)
+
+    with open(filepath) as csvfile:
+        return [{key: [int(x) for x in value.split()] for key, value in row.items() if value}
+                for row in csv.DictReader(csvfile)]
+
+
+def batch_match_simulator(lineups, model_name=DEFAULT_MODEL_NAME, batch_size=1024):
+    """Yield the 1X2 probabilities of many lineups, scored in batches with one loaded model."""
+    feature_vectors = normalise_features(pad_lineups(lineups))
+
+    predictor = load_predictor(model_name)
+
+    for start in range(0, len(feature_vectors), batch_size):
+        for probability in predictor.predict(feature_vectors[start:start + batch_size]):
+            yield probability
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
 
+    parser.add_argument(
+        '--lineups-file',
+        type=str,
+        required=False,
+        help="""\
+      A json or csv file of lineups to score in one batch instead of a single match.\
+      """
+    )
     parser.add_argument(
         '--home-goalkeeper',
         type=int,
         nargs=1,
-        required=True,
+        required=False,
         help="""\
       An integer between 0 and 100 for the rating of the goalkeeper.\
       """
@@ -72,7 +125,7 @@ if __name__ == '__main__':
         '--away-goalkeeper',
         type=int,
         nargs=1,
-        required=True,
+        required=False,
         help="""\
           An integer between 0 and 100 for the rating of the goalkeeper.\
           """
@@ -115,6 +168,14 @@ if __name__ == '__main__':
 
     arguments, _ = parser.parse_known_args()
 
-    print(one_match_simulator(**vars(arguments)))
+    if arguments.lineups_file is not None:
+        for match_probability in batch_match_simulator(read_lineups(arguments.lineups_file)):
+            print(','.join(str(x) for x in match_probability))
+    else:
+        if arguments.home_goalkeeper is None or arguments.away_goalkeeper is None:
+            parser.error('--home-goalkeeper and --away-goalkeeper are required for a single match')
+        arguments = vars(arguments)
+        del arguments['lineups_file']
+        print(one_match_simulator(**arguments))
 
     # [0.42155302 0.2851767  0.29327026]
@@ -0,0 +1,238 @@
+import argparse
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import queue
+from socketserver import ThreadingMixIn
+import threading
+import time
+
+import numpy as np
+
+from fifa_ratings_predictor.data_methods import normalise_features
+from fifa_ratings_predictor.inference import load_predictor
+from fifa_ratings_predictor.one_match_simulator import DEFAULT_MODEL_NAME, pad_lineups
+
+
+class PredictionMetrics:
+    """Request, batch and latency counters for the prediction server."""
+
+    def __init__(self, latency_window=10000):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.requests = 0
+        self.rows = 0
+        self.batches = 0
+        self.latencies = deque(maxlen=latency_window)
+
+    def record_batch(self, number_of_rows):
+        with self.lock:
+            self.batches += 1
+            self.rows += number_of_rows
+
+    def record_request(self, latency):
+        with self.lock:
+            self.requests += 1
+            self.latencies.append(latency)
+
+    def summary(self):
+        with self.lock:
+            elapsed = time.time() - self.started
+            latencies = np.array(self.latencies) * 1000
+            return {
+                'uptime seconds': elapsed,
+                'requests': self.requests,
+                'rows': self.rows,
+                'batches': self.batches,
+                'mean batch size': self.rows / self.batches if self.batches else 0.0,
+                'requests per second': self.requests / elapsed if elapsed else 0.0,
+                'latency ms p50': float(np.percentile(latencies, 50)) if len(latencies) else None,
+                'latency ms p95': float(np.percentile(latencies, 95)) if len(latencies) else None,
+                'latency ms p99': float(np.percentile(latencies, 99)) if len(latencies) else None,
+            }
+
+
+class PredictionBatcher:
+    """Collects feature vectors from concurrent requests and scores them in single predict calls.
+
+    The first waiting request opens a batch, which is run once it holds max_batch_size rows or
+    max_wait seconds have passed.
+    """
+
+    def __init__(self, predictor, max_batch_size=256, max_wait=0.005, metrics=None):
+        self.predictor = predictor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.metrics = PredictionMetrics() if metrics is None else metrics
+        self.pending = queue.Queue()
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, feature_vectors):
+        future = Future()
+        self.pending.put((feature_vectors, future))
+        return future
+
+    def predict(self, feature_vectors):
+        return self.submit(feature_vectors).result()
+
+    def next_batch(self):
+        batch = [self.pending.get()]
+        number_of_rows = len(batch[0][0])
+        deadline = time.time() + self.max_wait
+
+        while number_of_rows < self.max_batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                item = self.pending.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(item)
+            number_of_rows += len(item[0])
+
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            feature_vectors = np.vstack([x for x, _ in batch])
+
+            try:
+                probabilities = self.predictor.predict(feature_vectors)
+            except Exception as exception:
+                for _, future in batch:
+                    future.set_exception(exception)
+                continue
+
+            self.metrics.record_batch(len(feature_vectors))
+
+            start = 0
+            for x, future in batch:
+                future.set_result(probabilities[start:start + len(x)])
+                start += len(x)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def make_handler(batcher):
+
+    class PredictionHandler(BaseHTTPRequestHandler):
+        """POST /predict scores lineups, GET /metrics reports the batcher's metrics."""
+
+        def send_json(self, status, body):
+            content = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def do_GET(self):
+            if self.path == '/metrics':
+                self.send_json(200, batcher.metrics.summary())
+            elif self.path == '/health':
+                self.send_json(200, {'status': 'ok'})
+            else:
+                self.send_json(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if self.path != '/predict':
+                self.send_json(404, {'error': 'not found'})
+                return
+
+            start = time.time()
+
+            try:
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode())
+                if 'lineups' in body:
+                    feature_vectors = pad_lineups(body['lineups'])
+                else:
+                    feature_vectors = np.array(body['feature vectors'], dtype=np.float64).reshape(-1, 36)
+            except (KeyError, ValueError, TypeError, AssertionError) as exception:
+                self.send_json(400, {'error': str(exception)})
+                return
+
+            try:
+                probabilities = batcher.predict(normalise_features(feature_vectors))
+            except Exception as exception:
+                self.send_json(500, {'error': str(exception)})
+                return
+
+            batcher.metrics.record_request(time.time() - start)
+
+            self.send_json(200, {'probabilities': probabilities.tolist()})
+
+        def log_message(self, format, *args):
+            pass
+
+    return PredictionHandler
+
+
+def make_server(model_name=DEFAULT_MODEL_NAME, host='127.0.0.1', port=8000, max_batch_size=256, max_wait=0.005):
+    """Load the model once and return an HTTP server that micro-batches prediction requests.
+
+    Requests to POST /predict send either {"feature vectors": [[36 ratings], ...]} or
+    {"lineups": [...]} in the format accepted by pad_lineups, and receive
+    {"probabilities": [[home, draw, away], ...]}.
+    """
+    batcher = PredictionBatcher(load_predictor(model_name), max_batch_size=max_batch_size, max_wait=max_wait)
+    return ThreadingHTTPServer((host, port), make_handler(batcher))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '--model-name',
+        type=str,
+        default=DEFAULT_MODEL_NAME,
+        help="""\
+      Path of the model checkpoint to serve.\
+      """
+    )
+    parser.add_argument(
+        '--host',
+        type=str,
+        default='127.0.0.1',
+        help="""\
+      Address to listen on.\
+      """
+    )
+    parser.add_argument(
+        '--port',
+        type=int,
+        default=8000,
+        help="""\
+      Port to listen on.\
+      """
+    )
+    parser.add_argument(
+        '--max-batch-size',
+        type=int,
+        default=256,
+        help="""\
+      Largest number of lineups scored in one inference call.\
+      """
+    )
+    parser.add_argument(
+        '--max-wait',
+        type=float,
+        default=0.005,
+        help="""\
+      Seconds to wait for more requests before running a batch.\
+      """
+    )
+
+    arguments = parser.parse_args()
+
+    server = make_server(arguments.model_name, arguments.host, arguments.port, arguments.max_batch_size,
+                         arguments.max_wait)
+    print('Serving {} on http://{}:{}'.format(arguments.model_name, arguments.host, arguments.port))
+    server.serve_forever()
@@ -1,3 +1,4 @@
+from collections import OrderedDict
 import os
 
 import numpy as np
@@ -5,7 +6,9 @@ import pandas as pd
 from tqdm import tqdm
 
 from fifa_ratings_predictor.data_methods import read_fixtures_data, normalise_features
-from fifa_ratings_predictor.model import NeuralNet
+from fifa_ratings_predictor.inference import load_predictor
+from fifa_ratings_predictor.monte_carlo import AWAY_WIN, DEFAULT_ZONES, DRAW, HOME_WIN, calibrate_goal_rates, \
+    count_positions, played_standings, rank_teams, sample_results, simulate_seasons, zone_slice
 
 PREDICTED_LINEUPS2 = {'afc-bournemouth': np.array([80, 76, 77, 78, 76, 0, 0, 68, 73, 76, 0, 0, 0, 0, 74, 77, 77, 0]),
                       'arsenal': np.array([85, 80, 83, 80, 85, 0, 0, 78, 83, 87, 0, 0, 0, 0, 87, 84, 84, 0]),
@@ -36,25 +39,69 @@ class SeasonSimulator:
     os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 
     def __init__(self, match_fixtures, predicted_lineups, model_path, write_to_csv=False,
-                 csv_filepath=None):
+                 csv_filepath=None, zones=None, played_matches=None):
         self.predicted_lineups = predicted_lineups
         self.fixtures = match_fixtures
         self.write_to_csv = write_to_csv
         self.csv_filepath = csv_filepath
         self.model_path = model_path
+        self.zones = DEFAULT_ZONES if zones is None else OrderedDict(zones)
+        self.teams = list(self.predicted_lineups.keys())
+        self.played_matches = [] if played_matches is None else played_matches
 
         self.total_points = dict.fromkeys(self.predicted_lineups.keys(), 0)
         self.wins = dict.fromkeys(self.predicted_lineups.keys(), 0)
         self.draws = dict.fromkeys(self.predicted_lineups.keys(), 0)
         self.losses = dict.fromkeys(self.predicted_lineups.keys(), 0)
-        self.league_wins = dict.fromkeys(self.predicted_lineups.keys(), 0)
-        self.relegation = dict.fromkeys(self.predicted_lineups.keys(), 0)
-        self.top_4 = dict.fromkeys(self.predicted_lineups.keys(), 0)
+        self.goals_for = dict.fromkeys(self.predicted_lineups.keys(), 0)
+        self.goals_against = dict.fromkeys(self.predicted_lineups.keys(), 0)
+        self.scorelines = False
+        self.goal_rates = {}
+        self.zone_counts = OrderedDict((zone, dict.fromkeys(self.predicted_lineups.keys(), 0)) for zone in self.zones)
+        self.position_counts = np.zeros((len(self.teams), len(self.teams)), dtype=np.int64)
+        self.number_of_simulations = 0
+
+    def get_team_indices(self, season_fixtures):
+        teams = self.teams
+        team_to_index = {team: i for i, team in enumerate(teams)}
+        home_indices = np.array([team_to_index[fixture['home team']] for fixture in season_fixtures], dtype=int)
+        away_indices = np.array([team_to_index[fixture['away team']] for fixture in season_fixtures], dtype=int)
+        return teams, home_indices, away_indices
+
+    def get_played_standings(self):
+        """SeasonTally of the played matches, which every simulated season starts from."""
+        teams, home_indices, away_indices = self.get_team_indices(self.played_matches)
+        return played_standings(home_indices, away_indices, [match['home goals'] for match in self.played_matches],
+                                [match['away goals'] for match in self.played_matches], len(teams))
+
+    def get_remaining_fixtures(self, season_fixtures):
+        played = {(match['home team'], match['away team']) for match in self.played_matches}
+        return [fixture for fixture in season_fixtures if (fixture['home team'], fixture['away team']) not in played]
+
+    def add_tally(self, teams, tally):
+        for i, team in enumerate(teams):
+            self.total_points[team] += int(tally.total_points[i])
+            self.wins[team] += int(tally.wins[i])
+            self.draws[team] += int(tally.draws[i])
+            self.losses[team] += int(tally.losses[i])
+            self.goals_for[team] += int(tally.goals_for[i])
+            self.goals_against[team] += int(tally.goals_against[i])
+
+        self.add_positions(teams, tally.positions, tally.number_of_simulations)
+
+    def add_positions(self, teams, positions, number_of_simulations):
+        for zone, zone_positions in self.zones.items():
+            for team, count in zip(teams, positions[:, zone_slice(zone_positions, len(teams))].sum(axis=1)):
+                self.zone_counts[zone][team] += int(count)
+
+        self.position_counts += positions
+        self.number_of_simulations += number_of_simulations
 
     def get_match_probabilities(self, match_fixtures, verbose=False):
-        feature_vectors = []
+        if not match_fixtures:
+            return []
 
-        net = NeuralNet()
+        feature_vectors = []
 
         for fixture in tqdm(match_fixtures, desc='Getting match probabilities...', disable=not verbose):
             home_team, away_team = fixture['home team'], fixture['away team']
@@ -62,43 +109,58 @@ class SeasonSimulator:
                 away_team])).reshape(
                 (1, 36)))
 
-        predictions = net.predict(np.vstack((x for x in feature_vectors)), model_name=self.model_path)
+        predictions = load_predictor(self.model_path).predict(np.vstack((x for x in feature_vectors)))
 
         match_probabilities = [x for x in predictions]
 
         return match_probabilities
 
-    def run_season(self, season_fixtures, match_results):
+    def get_goal_rates(self, match_fixtures, match_probabilities):
+        """Poisson (home, away) goal rates of each fixture, calibrated once and cached by fixture."""
+        keys = [(fixture['home team'], fixture['away team'], tuple(np.round(probabilities, 12)))
+                for fixture, probabilities in zip(match_fixtures, match_probabilities)]
+        uncached = [i for i, key in enumerate(keys) if key not in self.goal_rates]
+
+        if uncached:
+            goal_rates = calibrate_goal_rates(np.array([match_probabilities[i] for i in uncached]))
+            for i, rates in zip(uncached, goal_rates):
+                self.goal_rates[keys[i]] = rates
+
+        return np.array([self.goal_rates[key] for key in keys])
+
+    def run_season(self, season_fixtures, match_results, seed=None):
         assert len(season_fixtures) == len(match_results), "Each fixture must have it's '1X2 probabilities"
-        league_points = dict.fromkeys(self.predicted_lineups.keys(), 0)
+
+        standings = self.get_played_standings()
+        self.add_tally(self.teams, standings)
+        league_points = dict(zip(self.teams, standings.total_points.tolist()))
 
         for fixture, result in zip(season_fixtures, match_results):
 
             home_team, away_team = fixture['home team'], fixture['away team']
 
-            if result == '1':
+            if result == HOME_WIN:
                 self.total_points[home_team] += 3
                 league_points[home_team] += 3
                 self.wins[home_team] += 1
                 self.losses[away_team] += 1
-            elif result == 'X':
+            elif result == DRAW:
                 self.total_points[home_team] += 1
                 self.total_points[away_team] += 1
                 league_points[home_team] += 1
                 league_points[away_team] += 1
                 self.draws[home_team] += 1
                 self.draws[away_team] += 1
-            elif result == '2':
+            elif result == AWAY_WIN:
                 self.total_points[away_team] += 3
                 league_points[away_team] += 3
                 self.wins[away_team] += 1
                 self.losses[home_team] += 1
-        league_positions = sorted(league_points.items(), key=lambda x: x[1], reverse=True)
-        self.league_wins[league_positions[0][0]] += 1
-        for team, points in league_positions[:4]:
-            self.top_4[team] += 1
-        for team, points in league_positions[-3:]:
-            self.relegation[team] += 1
+
+        points = np.array([league_points[team] for team in self.teams])[:, None]
+        positions = count_positions(rank_teams(points, np.random.default_rng(seed)), len(self.teams))
+
+        self.add_positions(self.teams, positions, 1)
 
     def normalise_season_values(self, number_of_simulations):
         for k in self.total_points.keys():
@@ -106,41 +168,60 @@ class SeasonSimulator:
             self.wins[k] = self.wins[k] / number_of_simulations
             self.draws[k] = self.draws[k] / number_of_simulations
             self.losses[k] = self.losses[k] / number_of_simulations
-            self.league_wins[k] = self.league_wins[k] / number_of_simulations
-            self.top_4[k] = self.top_4[k] / number_of_simulations
-            self.relegation[k] = self.relegation[k] / number_of_simulations
+            self.goals_for[k] = self.goals_for[k] / number_of_simulations
+            self.goals_against[k] = self.goals_against[k] / number_of_simulations
+            for zone_count in self.zone_counts.values():
+                zone_count[k] = zone_count[k] / number_of_simulations
 
     def convert_to_pandas(self, write_to_csv=False):
         df = pd.DataFrame(
-            [self.total_points, self.wins, self.draws, self.losses, self.league_wins, self.top_4, self.relegation],
+            [self.total_points, self.wins, self.draws, self.losses] + list(self.zone_counts.values()),
             index=['Points', 'Wins',
-                   'Draws', 'Losses',
-                   '1st Place',
-                   'Top 4',
-                   'Relegation']).T
+                   'Draws', 'Losses'] + list(self.zone_counts.keys())).T
+        sort_by = ['Points']
+
+        if self.scorelines:
+            df.insert(4, 'Goals For', pd.Series(self.goals_for))
+            df.insert(5, 'Goals Against', pd.Series(self.goals_against))
+            df.insert(6, 'Goal Difference', df['Goals For'] - df['Goals Against'])
+            sort_by.append('Goal Difference')
 
         if write_to_csv:
-            df.sort_values(by='Points', ascending=False).round(decimals=2).to_csv(
+            df.sort_values(by=sort_by, ascending=False).round(decimals=2).to_csv(
                 self.csv_filepath)
 
-        return df.sort_values(by='Points', ascending=False).round(decimals=2)
+        return df.sort_values(by=sort_by, ascending=False).round(decimals=2)
+
+    def position_probabilities(self):
+        """Teams x final positions DataFrame of the probability of each team finishing in each position."""
+        df = pd.DataFrame(self.position_counts / max(self.number_of_simulations, 1), index=self.teams,
+                          columns=np.arange(1, len(self.teams) + 1))
+        return df.iloc[df.values.dot(np.arange(len(self.teams))).argsort()]
 
     @staticmethod
-    def get_match_results_from_probabilities(match_probabilities, number_of_simulations):
-        return [np.random.choice(['1', 'X', '2'], size=number_of_simulations, p=match_probability) for
-                match_probability in match_probabilities]
+    def get_match_results_from_probabilities(match_probabilities, number_of_simulations, seed=None):
+        return sample_results(match_probabilities, number_of_simulations, seed=seed)
 
-    def simulate_monte_carlo(self, number_of_simulations, verbose=False, normalise=True):
+    def simulate_monte_carlo(self, number_of_simulations, verbose=False, normalise=True, seed=None, processes=1,
+                             scorelines=False):
 
         for k, v in self.predicted_lineups.items():
             self.predicted_lineups[k] = normalise_features(v)
 
-        probabilities = self.get_match_probabilities(self.fixtures, verbose=verbose)
+        remaining_fixtures = self.get_remaining_fixtures(self.fixtures)
+
+        probabilities = self.get_match_probabilities(remaining_fixtures, verbose=verbose)
+
+        teams, home_indices, away_indices = self.get_team_indices(remaining_fixtures)
+
+        goal_rates = self.get_goal_rates(remaining_fixtures, probabilities) if scorelines else None
+        self.scorelines = scorelines
 
-        results = self.get_match_results_from_probabilities(probabilities, number_of_simulations)
+        tally = simulate_seasons(np.array(probabilities), number_of_simulations, home_indices, away_indices,
+                                 len(teams), seed=seed, processes=processes, goal_rates=goal_rates,
+                                 base=self.get_played_standings() if self.played_matches else None)
 
-        for i in tqdm(range(number_of_simulations), desc='running_simulations', disable=not verbose):
-            self.run_season(self.fixtures, [x[i] for x in results])
+        self.add_tally(teams, tally)
 
         if normalise:
             self.normalise_season_values(number_of_simulations)